@@ -0,0 +1,262 @@
+import collections
+import concurrent.futures
+import itertools
+import logging
+import os
+import shlex
+import subprocess
+import threading
+
+MAX_RETRIES = 1
+DEFAULT_TIMEOUT = 120.0
+
+
+class AdbShellSession:
+    """
+    A long-lived 'adb shell' that runs many commands over one channel.
+    Each command is followed by a sentinel line carrying its exit code, so
+    commands can be pipelined: they are written as soon as they are queued
+    and their outputs are matched back in order by the reader thread.
+    If the shell dies, it is restarted and queued commands are resent; if a
+    command times out, the session is killed and restarted without it.
+    """
+
+    def __init__(self, adb_path, serial=None):
+        self.adb_path = adb_path
+        self.serial = serial
+        self._marker = f"__OPFU_{os.getpid()}_{id(self):x}__"
+        self._ids = itertools.count(1)
+        self._pending = collections.deque()
+        self._lock = threading.Lock()
+        self._process = None
+        self._closed = False
+
+    # --------------- Public API ---------------
+    def submit(self, command, retry=True):
+        """
+        Queues a command without waiting for it.
+
+        :param command: Shell command line to run on the device.
+        :param retry: Resend the command if the shell drops before it finishes.
+            Disable for commands that must not run twice.
+        :return: Future resolving to a subprocess.CompletedProcess.
+        """
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._closed:
+                raise ConnectionError("adb shell session is closed")
+            entry = {
+                "id": next(self._ids),
+                "command": command,
+                "future": future,
+                "retry": retry,
+                "attempts": 0,
+            }
+            self._pending.append(entry)
+            if self._process is None:
+                try:
+                    self._spawn()
+                except OSError:
+                    self._pending.remove(entry)
+                    raise
+            else:
+                self._send(entry)
+        return future
+
+    def run(self, command, timeout=DEFAULT_TIMEOUT, check=False, retry=True):
+        """
+        Runs a command and waits for its result.
+
+        :param timeout: Seconds to wait, or None to wait indefinitely. On timeout
+            the session is restarted, so a command that wedges the shell (say, an
+            unbalanced quote) does not take every later command down with it.
+        :return: subprocess.CompletedProcess with returncode and stdout.
+        """
+        future = self.submit(command, retry=retry)
+        try:
+            result = future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            self._abandon(future)
+            raise TimeoutError(f"adb shell command timed out: {command}")
+        if check:
+            result.check_returncode()
+        return result
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            process = self._process
+            self._process = None
+        if process is not None:
+            try:
+                process.stdin.write(b"exit\n")
+                process.stdin.flush()
+                process.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                process.kill()
+        self._fail_pending(ConnectionError("adb shell session closed"))
+
+    # --------------- Internals ---------------
+    def _spawn(self):
+        args = [self.adb_path]
+        if self.serial:
+            args += ["-s", self.serial]
+        args.append("shell")
+        self._process = subprocess.Popen(
+            args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            bufsize=0,
+        )
+        threading.Thread(
+            target=self._read_loop, args=(self._process,), daemon=True
+        ).start()
+        logging.debug(f"Opened adb shell session for {self.serial or 'default device'}")
+        for entry in self._pending:
+            self._send(entry)
+
+    def _send(self, entry):
+        entry["attempts"] += 1
+        # Each command runs in its own subshell so `exit`, `cd` or `export`
+        # cannot end the session or leak into later commands. Its stdin is
+        # detached from our queued input and stderr folds into the framed output.
+        script = (
+            f"( {entry['command']}\n) </dev/null 2>&1\n"
+            f"printf '\\n%s %d\\n' {self._marker}{entry['id']} $?\n"
+        )
+        try:
+            self._process.stdin.write(script.encode())
+            self._process.stdin.flush()
+        except OSError:
+            # The reader thread sees EOF and handles reconnection.
+            pass
+
+    def _abandon(self, future):
+        with self._lock:
+            entry = next(
+                (entry for entry in self._pending if entry["future"] is future), None
+            )
+            if entry is None:
+                # Completed while we were giving up on it.
+                return
+            self._pending.remove(entry)
+            process = self._process
+        future.cancel()
+        logging.warning(
+            f"adb shell for {self.serial or 'default device'} timed out on "
+            f"'{entry['command']}'; restarting session."
+        )
+        if process is not None:
+            # The reader thread sees EOF and resends the remaining commands.
+            process.kill()
+
+    def _read_loop(self, process):
+        lines = []
+        for raw in iter(process.stdout.readline, b""):
+            line = raw.decode(errors="replace")
+            if not line.startswith(self._marker):
+                lines.append(line)
+                continue
+            tag, _, code = line.strip().partition(" ")
+            output = "".join(lines)
+            lines = []
+            if output.endswith("\r\n"):
+                output = output[:-2]
+            elif output.endswith("\n"):
+                output = output[:-1]
+            with self._lock:
+                entry = self._pending[0] if self._pending else None
+                if entry is not None and tag == f"{self._marker}{entry['id']}":
+                    self._pending.popleft()
+                else:
+                    entry = None
+            if entry is None:
+                # e.g. the frame of a command abandoned after a timeout
+                logging.error(f"Unexpected adb shell frame: {tag}")
+                continue
+            entry["future"].set_result(
+                subprocess.CompletedProcess(
+                    entry["command"], int(code), stdout=output
+                )
+            )
+        process.wait()
+        self._reconnect(process)
+
+    def _reconnect(self, process):
+        with self._lock:
+            if self._process is not process or self._closed:
+                return
+            self._process = None
+            failed = [
+                entry
+                for entry in self._pending
+                if not entry["retry"] or entry["attempts"] > MAX_RETRIES
+            ]
+            for entry in failed:
+                self._pending.remove(entry)
+            if self._pending:
+                logging.warning(
+                    f"adb shell for {self.serial or 'default device'} dropped; reconnecting."
+                )
+                try:
+                    self._spawn()
+                except OSError as e:
+                    failed.extend(self._pending)
+                    self._pending.clear()
+                    logging.error(f"Failed to reopen adb shell: {e}")
+        for entry in failed:
+            entry["future"].set_exception(
+                ConnectionError(f"adb shell dropped while running: {entry['command']}")
+            )
+
+    def _fail_pending(self, error):
+        with self._lock:
+            pending = list(self._pending)
+            self._pending.clear()
+        for entry in pending:
+            if not entry["future"].done():
+                entry["future"].set_exception(error)
+
+
+class AdbShellPool:
+    """
+    Hands out one persistent shell session per device serial.
+    """
+
+    def __init__(self, adb_path):
+        self.adb_path = adb_path
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session(self, serial=None):
+        with self._lock:
+            session = self._sessions.get(serial)
+            if session is None:
+                session = AdbShellSession(self.adb_path, serial)
+                self._sessions[serial] = session
+            return session
+
+    def run(self, args, serial=None, timeout=DEFAULT_TIMEOUT, check=False, retry=True):
+        """
+        Runs a command on a device through its pooled session.
+
+        :param args: Command string or list of arguments (quoted for sh).
+        """
+        command = args if isinstance(args, str) else shlex.join(args)
+        return self.session(serial).run(
+            command, timeout=timeout, check=check, retry=retry
+        )
+
+    def close(self, serial=None):
+        with self._lock:
+            session = self._sessions.pop(serial, None)
+        if session is not None:
+            session.close()
+
+    def close_all(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
@@ -0,0 +1,203 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+from config_loader import CONFIG_FILE_PATH, load_config
+
+CATALOG_DB_PATH = "device_catalog.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS profiles (
+    name TEXT PRIMARY KEY,
+    position INTEGER,
+    codename TEXT,
+    digest TEXT,
+    body TEXT
+);
+CREATE TABLE IF NOT EXISTS aliases (
+    alias TEXT PRIMARY KEY,
+    name TEXT REFERENCES profiles(name) ON DELETE CASCADE
+);
+"""
+
+
+def normalize_alias(value):
+    """Lowercases and strips separators so 'GM 1913' and 'gm-1913' match."""
+    return re.sub(r"[\s_\-]+", "", value or "").lower()
+
+
+def profile_aliases(name, body):
+    aliases = {normalize_alias(name)}
+    if isinstance(body, dict):
+        aliases.add(normalize_alias(body.get("codename")))
+        for alias in body.get("aliases", []):
+            aliases.add(normalize_alias(alias))
+    aliases.discard("")
+    return aliases
+
+
+class DeviceCatalog:
+    """
+    SQLite index over the device profiles in config.json.
+    Profiles are keyed by name, codename and model aliases; bodies (ROM
+    lists, firmware entries) stay serialized until a profile is requested.
+    The index is refreshed incrementally: only profiles whose JSON changed
+    since the last build are rewritten.
+    """
+
+    def __init__(self, source=CONFIG_FILE_PATH, db_path=CATALOG_DB_PATH):
+        self.source = source
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.execute("PRAGMA foreign_keys = ON")
+        self._connection.executescript(SCHEMA)
+        self._aliases = {}
+        self._profiles = {}
+        self.refresh()
+
+    # --------------- Index Maintenance ---------------
+    def _source_signature(self):
+        try:
+            stat = os.stat(self.source)
+        except FileNotFoundError:
+            return None
+        return f"{os.path.abspath(self.source)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+    def refresh(self):
+        """
+        Rebuilds changed profiles if the source JSON changed since the last build.
+
+        :return: Number of profiles added, updated or removed.
+        """
+        with self._lock:
+            signature = self._source_signature()
+            row = self._connection.execute(
+                "SELECT value FROM meta WHERE key = 'source'"
+            ).fetchone()
+            changes = 0
+            if signature is None or row is None or row[0] != signature:
+                changes = self._rebuild()
+            if changes or not self._aliases:
+                self._aliases = dict(
+                    self._connection.execute("SELECT alias, name FROM aliases")
+                )
+                self._profiles = {}
+        return changes
+
+    def _read_source(self):
+        if not os.path.exists(self.source):
+            return load_config(self.source)
+        try:
+            with open(self.source, "r") as f:
+                return json.load(f)
+        except json.JSONDecodeError as e:
+            # Keep serving the last good index rather than falling back to defaults.
+            logging.error(f"Error decoding {self.source}: {e}")
+            return None
+
+    def _rebuild(self):
+        config = self._read_source()
+        if config is None:
+            return 0
+        stored = dict(self._connection.execute("SELECT name, digest FROM profiles"))
+        changes = 0
+        with self._connection:
+            for position, (name, body) in enumerate(config.items()):
+                serialized = json.dumps(body, sort_keys=True)
+                digest = hashlib.sha1(serialized.encode()).hexdigest()
+                codename = body.get("codename") if isinstance(body, dict) else None
+                if stored.pop(name, None) == digest:
+                    self._connection.execute(
+                        "UPDATE profiles SET position = ? WHERE name = ?",
+                        (position, name),
+                    )
+                    continue
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO profiles VALUES (?, ?, ?, ?, ?)",
+                    (name, position, codename, digest, serialized),
+                )
+                changes += 1
+            for name in stored:
+                self._connection.execute("DELETE FROM profiles WHERE name = ?", (name,))
+                changes += 1
+            if changes:
+                # Aliases can move between profiles, so rebuild them all at once.
+                self._connection.execute("DELETE FROM aliases")
+                self._connection.executemany(
+                    "INSERT INTO aliases VALUES (?, ?)",
+                    self._alias_rows(config).items(),
+                )
+            self._connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('source', ?)",
+                (self._source_signature(),),
+            )
+        logging.info(f"Device catalog rebuilt from {self.source}: {changes} changes")
+        return changes
+
+    @staticmethod
+    def _alias_rows(config):
+        """Maps every alias to its profile; the first profile in config order wins."""
+        owners = {}
+        for name, body in config.items():
+            for alias in sorted(profile_aliases(name, body)):
+                owner = owners.setdefault(alias, name)
+                if owner != name:
+                    logging.warning(
+                        f"Alias '{alias}' of profile {name} is already used by "
+                        f"{owner}; ignoring it"
+                    )
+        return owners
+
+    # --------------- Lookups ---------------
+    def profile_names(self):
+        with self._lock:
+            return [
+                name
+                for (name,) in self._connection.execute(
+                    "SELECT name FROM profiles ORDER BY position"
+                )
+            ]
+
+    def get_profile(self, name):
+        """Loads a profile body on first use and caches it."""
+        with self._lock:
+            if name not in self._profiles:
+                row = self._connection.execute(
+                    "SELECT body FROM profiles WHERE name = ?", (name,)
+                ).fetchone()
+                self._profiles[name] = json.loads(row[0]) if row else None
+            return self._profiles[name]
+
+    def match(self, model=None, device=None):
+        """
+        Finds the profile for a device from its ro.product.device / ro.product.model.
+
+        :return: Profile name, or None if nothing matches.
+        """
+        for value in (device, model):
+            name = self._aliases.get(normalize_alias(value))
+            if name is not None:
+                return name
+        return None
+
+    def match_many(self, identities):
+        """
+        Matches many devices at once.
+
+        :param identities: Mapping of serial to (model, device) tuples.
+        :return: Mapping of serial to profile name (or None).
+        """
+        return {
+            serial: self.match(model, device)
+            for serial, (model, device) in identities.items()
+        }
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -3,6 +3,13 @@ import subprocess
 import os
 import logging
 
+from adb_shell import DEFAULT_TIMEOUT, AdbShellPool
+from fastboot_client import FastbootClient, FastbootError
+from payload_extractor import PayloadExtractor, PayloadError
+from rom_validator import RomValidator
+from source_selector import SourceSelector, StallError, candidate_urls
+from state_manager import ADB_STATE_MODES, MODE_BOOTLOADER, StateManager
+
 
 class DeviceManager:
     ADB_PATH = (
@@ -10,6 +17,51 @@ class DeviceManager:
     )
     FASTBOOT_PATH = "C:/Users/willh/Downloads/platform-tools-latest-windows/platform-tools/fastboot.exe"
 
+    # TWRP backups and installs run far longer than the default shell timeout
+    TWRP_TIMEOUT = 30 * 60
+
+    # One persistent shell per device, so short queries cost a single round trip
+    shell_pool = AdbShellPool(ADB_PATH)
+
+    @staticmethod
+    def run_shell(args, retry=True, timeout=DEFAULT_TIMEOUT):
+        """Runs a command in the device's persistent adb shell and returns its output."""
+        return DeviceManager.shell_pool.run(
+            args, timeout=timeout, check=True, retry=retry
+        ).stdout
+
+    @staticmethod
+    def get_device_mode(serial=None):
+        """
+        Detects which mode the device is booted into and records it in StateManager.
+
+        :return: One of the state_manager MODE_* values, or None if no device answers.
+        """
+        serial_args = ["-s", serial] if serial else []
+        mode = None
+        try:
+            state = subprocess.run(
+                [DeviceManager.ADB_PATH, *serial_args, "get-state"],
+                capture_output=True,
+                timeout=10,
+            ).stdout.decode().strip()
+            mode = ADB_STATE_MODES.get(state)
+            if mode is None:
+                devices = subprocess.run(
+                    [DeviceManager.FASTBOOT_PATH, "devices"],
+                    capture_output=True,
+                    timeout=10,
+                ).stdout.decode()
+                serials = [
+                    line.split()[0] for line in devices.splitlines() if line.strip()
+                ]
+                if serials and (serial is None or serial in serials):
+                    mode = MODE_BOOTLOADER
+        except (OSError, subprocess.SubprocessError) as e:
+            logging.error(f"Failed to detect device mode: {e}")
+        StateManager.set_device_mode(mode, serial)
+        return mode
+
     @staticmethod
     def root_device(preserve_encryption=True):
         if preserve_encryption:
@@ -44,7 +96,60 @@ class DeviceManager:
             logging.error(f"Failed to flash {partition}: {e}")
 
     @staticmethod
-    def flash_rom(rom_path):
+    def download_artifact(entry, destination):
+        """
+        Downloads a ROM, TWRP or firmware entry from config.json, racing its mirrors.
+
+        :param entry: URL string or dict with 'url'/'repo_url'/'mirrors' and 'md5'.
+        :param destination: Path to save the file to.
+        """
+        urls = candidate_urls(entry)
+        expected_md5 = entry.get("md5") if isinstance(entry, dict) else None
+        try:
+            return SourceSelector().download(urls, destination, expected_md5)
+        except (OSError, ValueError, StallError) as e:
+            logging.error(f"Failed to download {destination}: {e}")
+            return None
+
+    @staticmethod
+    def flash_partitions_over_tcp(address, images):
+        """
+        Flashes several partitions over one native fastboot TCP connection.
+
+        :param address: Fastboot TCP address, e.g. 'tcp:192.168.1.5'.
+        :param images: Mapping of partition name to image path.
+        """
+        try:
+            for image_path in images.values():
+                if not DeviceManager.verify_image(image_path):
+                    logging.error(
+                        "Integrity check failed for %s. Aborting flash.", image_path
+                    )
+                    return False
+            with FastbootClient(address) as client:
+                client.flash_all(images)
+            logging.info("Flashed %d partitions over %s", len(images), address)
+            return True
+        except (OSError, FastbootError) as e:
+            logging.error(f"Failed to flash partitions over {address}: {e}")
+            return False
+
+    @staticmethod
+    def validate_rom(rom_path, codenames=None):
+        result = RomValidator().validate(rom_path, codenames)
+        for warning in result["warnings"]:
+            logging.warning(f"{rom_path}: {warning}")
+        for error in result["errors"]:
+            logging.error(f"{rom_path}: {error}")
+        return result["valid"]
+
+    @staticmethod
+    def flash_rom(rom_path, codenames=None):
+        if not DeviceManager.validate_rom(rom_path, codenames):
+            logging.error(
+                "Pre-flight validation failed for %s. Aborting flash.", rom_path
+            )
+            return False
         try:
             logging.info(f"Starting to flash ROM: {rom_path}")
             subprocess.run([DeviceManager.ADB_PATH, "sideload", rom_path], check=True)
@@ -58,9 +163,11 @@ class DeviceManager:
     def flash_kernel(kernel_image):
         try:
             if DeviceManager.verify_image(kernel_image):
-                subprocess.run(
-                    [DeviceManager.ADB_PATH, "reboot", "bootloader"], check=True
-                )
+                if DeviceManager.get_device_mode() != MODE_BOOTLOADER:
+                    subprocess.run(
+                        [DeviceManager.ADB_PATH, "reboot", "bootloader"], check=True
+                    )
+                    StateManager.set_device_mode(MODE_BOOTLOADER)
                 subprocess.run(
                     [DeviceManager.FASTBOOT_PATH, "flash", "boot", kernel_image],
                     check=True,
@@ -92,50 +199,55 @@ class DeviceManager:
     @staticmethod
     def check_battery_level():
         try:
-            battery_level = subprocess.check_output(
-                [DeviceManager.ADB_PATH, "shell", "dumpsys", "battery"]
-            ).decode()
+            battery_level = DeviceManager.run_shell(["dumpsys", "battery"])
             logging.info("Battery status: %s", battery_level)
             return battery_level
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError, OSError) as e:
             logging.error("Failed to retrieve battery status: %s", e)
             return None
 
     @staticmethod
     def get_device_info():
         try:
-            device_info = subprocess.check_output(
-                [DeviceManager.ADB_PATH, "shell", "getprop"]
-            ).decode()
+            device_info = DeviceManager.run_shell(["getprop"])
             logging.info("Device info: %s", device_info)
             return device_info
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError, OSError) as e:
             logging.error("Failed to retrieve device information: %s", e)
             return None
 
     @staticmethod
     def get_device_model():
         try:
-            model = (
-                subprocess.check_output(
-                    [DeviceManager.ADB_PATH, "shell", "getprop", "ro.product.model"]
-                )
-                .decode()
-                .strip()
-            )
+            model = DeviceManager.run_shell(["getprop", "ro.product.model"]).strip()
             logging.info(f"Device model: {model}")
             return model
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError, OSError) as e:
             logging.error(f"Failed to retrieve device model: {e}")
             return None
 
+    @staticmethod
+    def get_device_identity(serial=None):
+        """Returns (ro.product.model, ro.product.device) in one shell round trip."""
+        try:
+            output = DeviceManager.shell_pool.run(
+                "getprop ro.product.model; getprop ro.product.device",
+                serial=serial,
+                check=True,
+            ).stdout
+            model, _, device = output.partition("\n")
+            return model.strip(), device.strip()
+        except (subprocess.CalledProcessError, OSError) as e:
+            logging.error(f"Failed to retrieve device identity: {e}")
+            return None, None
+
     # --------------- Log Management ---------------
     @staticmethod
     def clear_logs():
         try:
-            subprocess.run([DeviceManager.ADB_PATH, "logcat", "-c"], check=True)
+            DeviceManager.run_shell(["logcat", "-c"])
             logging.info("Cleared logs on the device.")
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError, OSError) as e:
             logging.error(f"Failed to clear logs: {e}")
 
     @staticmethod
@@ -157,57 +269,63 @@ class DeviceManager:
             subprocess.run(
                 [DeviceManager.ADB_PATH, "push", ota_zip, "/sdcard/"], check=True
             )
-            subprocess.run(
-                [
-                    DeviceManager.ADB_PATH,
-                    "shell",
-                    "twrp",
-                    "install",
-                    f"/sdcard/{os.path.basename(ota_zip)}",
-                ],
-                check=True,
+            DeviceManager.run_shell(
+                ["twrp", "install", f"/sdcard/{os.path.basename(ota_zip)}"],
+                retry=False,
+                timeout=DeviceManager.TWRP_TIMEOUT,
             )
             logging.info(f"OTA Update {ota_zip} applied successfully.")
             return True
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError, OSError) as e:
             logging.error(f"Failed to apply OTA update: {e}")
             return False
 
+    @staticmethod
+    def extract_ota_payload(ota_zip, output_dir, partitions=None):
+        try:
+            extractor = PayloadExtractor(ota_zip)
+            images = extractor.extract(output_dir, partitions=partitions)
+            logging.info(f"Extracted {len(images)} partition images from {ota_zip}")
+            return images
+        except (OSError, PayloadError) as e:
+            logging.error(f"Failed to extract OTA payload: {e}")
+            return None
+
     @staticmethod
     def backup_data_partition():
         try:
             logging.info("Starting data partition backup.")
-            subprocess.run(
-                [DeviceManager.ADB_PATH, "shell", "twrp", "backup", "data"], check=True
+            DeviceManager.run_shell(
+                ["twrp", "backup", "data"],
+                retry=False,
+                timeout=DeviceManager.TWRP_TIMEOUT,
             )
             logging.info("Data partition backup completed.")
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError, OSError) as e:
             logging.error(f"Failed to back up data partition: {e}")
 
     @staticmethod
     def restore_device():
         try:
-            subprocess.run(
-                [DeviceManager.ADB_PATH, "shell", "twrp", "restore", "SDB"], check=True
+            DeviceManager.run_shell(
+                ["twrp", "restore", "SDB"],
+                retry=False,
+                timeout=DeviceManager.TWRP_TIMEOUT,
             )
             logging.info("Device restored from backup successfully.")
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError, OSError) as e:
             logging.error(f"Failed to restore device: {e}")
 
     # --------------- Encryption Handling ---------------
     @staticmethod
     def detect_encryption_type():
         try:
-            encryption_type = (
-                subprocess.check_output(
-                    [DeviceManager.ADB_PATH, "shell", "getprop", "ro.crypto.type"]
-                )
-                .decode()
-                .strip()
-            )
+            encryption_type = DeviceManager.run_shell(
+                ["getprop", "ro.crypto.type"]
+            ).strip()
             logging.info(f"Detected encryption type: {encryption_type}")
             return encryption_type
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError, OSError) as e:
             logging.error(f"Error detecting encryption type: {e}")
             return None
 
@@ -236,19 +354,14 @@ class DeviceManager:
                 ],
                 check=True,
             )
-            subprocess.run(
-                [
-                    DeviceManager.ADB_PATH,
-                    "shell",
-                    "twrp",
-                    "install",
-                    "/sdcard/Disable_Dm-Verity_ForceEncrypt_FDE.zip",
-                ],
-                check=True,
+            DeviceManager.run_shell(
+                ["twrp", "install", "/sdcard/Disable_Dm-Verity_ForceEncrypt_FDE.zip"],
+                retry=False,
+                timeout=DeviceManager.TWRP_TIMEOUT,
             )
             logging.info("Applied FDE decryption tool.")
             return True
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError, OSError) as e:
             logging.error(f"Failed to apply FDE decryption tool: {e}")
             return False
 
@@ -264,19 +377,14 @@ class DeviceManager:
                 ],
                 check=True,
             )
-            subprocess.run(
-                [
-                    DeviceManager.ADB_PATH,
-                    "shell",
-                    "twrp",
-                    "install",
-                    "/sdcard/Disable_Dm-Verity_ForceEncrypt_FBE.zip",
-                ],
-                check=True,
+            DeviceManager.run_shell(
+                ["twrp", "install", "/sdcard/Disable_Dm-Verity_ForceEncrypt_FBE.zip"],
+                retry=False,
+                timeout=DeviceManager.TWRP_TIMEOUT,
             )
             logging.info("Applied FBE decryption tool.")
             return True
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError, OSError) as e:
             logging.error(f"Failed to apply FBE decryption tool: {e}")
             return False
 
@@ -0,0 +1,215 @@
+import logging
+import socket
+import subprocess
+import threading
+
+from device_manager import DeviceManager
+from state_manager import ADB_STATE_MODES, MODE_BOOTLOADER
+
+ADB_SERVER_ADDRESS = ("127.0.0.1", 5037)
+
+EVENT_ADDED = "added"
+EVENT_REMOVED = "removed"
+EVENT_CHANGED = "changed"
+
+
+def parse_device_list(output, source="adb"):
+    """
+    Parses 'adb devices' / 'fastboot devices' style output.
+
+    :param output: Text with one 'serial<TAB>state' entry per line.
+    :param source: 'adb' or 'fastboot'.
+    :return: Dictionary mapping serial to a device record.
+    """
+    devices = {}
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) < 2 or line.startswith("List of devices"):
+            continue
+        serial, state = parts[0], parts[1]
+        if source == "fastboot":
+            # Userspace fastbootd takes the same commands as the bootloader.
+            mode = MODE_BOOTLOADER
+        else:
+            mode = ADB_STATE_MODES.get(state)
+        devices[serial] = {
+            "serial": serial,
+            "state": state,
+            "mode": mode,
+            "source": source,
+        }
+    return devices
+
+
+class DeviceRegistry:
+    """
+    Keeps an in-memory view of attached devices.
+    adb devices are tracked through the adb server's track-devices stream,
+    which pushes a new list on every hotplug or state change; fastboot has
+    no equivalent, so it is enumerated on a slower interval.
+    Subscribers receive (event, record) callbacks for every difference.
+    """
+
+    reconnect_delay = 2.0
+    fastboot_interval = 2.0
+
+    def __init__(self, adb_path=None, fastboot_path=None, track_fastboot=True):
+        self.adb_path = adb_path or DeviceManager.ADB_PATH
+        self.fastboot_path = fastboot_path or DeviceManager.FASTBOOT_PATH
+        self.track_fastboot = track_fastboot
+        self._adb_devices = {}
+        self._fastboot_devices = {}
+        self._devices = {}
+        self._subscribers = []
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self._socket = None
+        self._threads = []
+
+    # --------------- Lifecycle ---------------
+    def start(self):
+        self._stop_event.clear()
+        targets = [self._track_adb]
+        if self.track_fastboot:
+            targets.append(self._poll_fastboot)
+        for target in targets:
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logging.info("Device registry started.")
+
+    def stop(self):
+        self._stop_event.set()
+        sock = self._socket
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+        logging.info("Device registry stopped.")
+
+    # --------------- Queries and Subscriptions ---------------
+    def subscribe(self, callback):
+        """Registers callback(event, record) for device changes."""
+        with self._condition:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._condition:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def devices(self):
+        with self._condition:
+            return [dict(record) for record in self._devices.values()]
+
+    def get(self, serial):
+        with self._condition:
+            record = self._devices.get(serial)
+            return dict(record) if record else None
+
+    def wait_for(self, serial, mode=None, timeout=None):
+        """
+        Blocks until the device is attached (and in the given mode, if any).
+
+        :return: The device record, or None on timeout.
+        """
+
+        def matches():
+            record = self._devices.get(serial)
+            return record and (mode is None or record["mode"] == mode)
+
+        with self._condition:
+            if not self._condition.wait_for(matches, timeout=timeout):
+                return None
+            return dict(self._devices[serial])
+
+    # --------------- Watchers ---------------
+    def _track_adb(self):
+        while not self._stop_event.is_set():
+            try:
+                with socket.create_connection(ADB_SERVER_ADDRESS, timeout=5) as sock:
+                    self._socket = sock
+                    request = b"host:track-devices"
+                    sock.sendall(b"%04x" % len(request) + request)
+                    status = self._recv_exact(sock, 4)
+                    if status != b"OKAY":
+                        raise ConnectionError(f"adb server replied {status!r}")
+                    sock.settimeout(None)
+                    while not self._stop_event.is_set():
+                        length = int(self._recv_exact(sock, 4), 16)
+                        payload = self._recv_exact(sock, length).decode()
+                        self._update("adb", parse_device_list(payload, "adb"))
+            except (OSError, ValueError) as e:
+                if self._stop_event.is_set():
+                    break
+                logging.warning(f"Lost adb track-devices connection: {e}")
+                self._update("adb", {})
+                self._start_adb_server()
+                self._stop_event.wait(self.reconnect_delay)
+            finally:
+                self._socket = None
+
+    def _poll_fastboot(self):
+        while not self._stop_event.is_set():
+            try:
+                output = subprocess.check_output(
+                    [self.fastboot_path, "devices"], timeout=10
+                ).decode()
+                self._update("fastboot", parse_device_list(output, "fastboot"))
+            except (OSError, subprocess.SubprocessError) as e:
+                logging.debug(f"fastboot enumeration failed: {e}")
+            self._stop_event.wait(self.fastboot_interval)
+
+    def _start_adb_server(self):
+        try:
+            subprocess.run([self.adb_path, "start-server"], check=True, timeout=30)
+        except (OSError, subprocess.SubprocessError) as e:
+            logging.error(f"Failed to start adb server: {e}")
+
+    @staticmethod
+    def _recv_exact(sock, size):
+        data = b""
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("adb server closed the connection")
+            data += chunk
+        return data
+
+    def _update(self, source, devices):
+        with self._condition:
+            if source == "adb":
+                self._adb_devices = devices
+            else:
+                self._fastboot_devices = devices
+            merged = dict(self._fastboot_devices)
+            merged.update(self._adb_devices)
+
+            events = []
+            for serial, record in merged.items():
+                previous = self._devices.get(serial)
+                if previous is None:
+                    events.append((EVENT_ADDED, dict(record)))
+                elif previous != record:
+                    events.append((EVENT_CHANGED, dict(record)))
+            for serial, record in self._devices.items():
+                if serial not in merged:
+                    events.append((EVENT_REMOVED, dict(record)))
+            self._devices = merged
+            subscribers = list(self._subscribers)
+            if events:
+                self._condition.notify_all()
+
+        for event, record in events:
+            logging.info(
+                f"Device {event}: {record['serial']} ({record['state']}, {record['mode']})"
+            )
+            for callback in subscribers:
+                try:
+                    callback(event, record)
+                except Exception:
+                    logging.exception("Device registry subscriber failed.")
@@ -0,0 +1,202 @@
+import logging
+import mmap
+import os
+import socket
+import struct
+
+DEFAULT_PORT = 5554
+HANDSHAKE = b"FB01"
+CHUNK_SIZE = 8 * 1024 * 1024
+
+REBOOT_COMMANDS = {
+    None: "reboot",
+    "system": "reboot",
+    "bootloader": "reboot-bootloader",
+    "fastboot": "reboot-fastboot",
+    "recovery": "reboot-recovery",
+}
+
+
+class FastbootError(Exception):
+    """Raised when the device answers FAIL or the protocol is violated."""
+
+
+def parse_address(address):
+    """
+    Parses a fastboot TCP address such as 'tcp:192.168.1.5:5554'.
+
+    :return: Tuple of (host, port).
+    """
+    if address.startswith("tcp:"):
+        address = address[4:]
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        return address, DEFAULT_PORT
+    return host, int(port)
+
+
+class FastbootClient:
+    """
+    In-process fastboot protocol client over the TCP transport.
+    One connection serves any number of commands, getvar results are cached
+    for the session, and images are streamed straight from mmap'd files.
+    The timeout covers connecting and the handshake only; like AOSP's TCP
+    transport, commands wait as long as the device takes (a flash or erase
+    can run for minutes without an INFO packet) unless command_timeout is set.
+    """
+
+    def __init__(self, address, timeout=30, command_timeout=None):
+        self.host, self.port = parse_address(address)
+        self.timeout = timeout
+        self.command_timeout = command_timeout
+        self._socket = None
+        self._vars = {}
+        self._have_all_vars = False
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # --------------- Transport ---------------
+    def connect(self):
+        self._socket = socket.create_connection((self.host, self.port), self.timeout)
+        try:
+            self._socket.sendall(HANDSHAKE)
+            reply = self._recv_exact(4)
+            if reply[:2] != b"FB" or not reply[2:].isdigit():
+                raise FastbootError(f"Bad fastboot handshake: {reply!r}")
+        except (OSError, FastbootError):
+            self.close()
+            raise
+        self._socket.settimeout(self.command_timeout)
+        logging.info(f"Connected to fastboot at {self.host}:{self.port}")
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+        self._vars = {}
+        self._have_all_vars = False
+
+    def _recv_exact(self, size):
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        received = 0
+        while received < size:
+            count = self._socket.recv_into(view[received:])
+            if not count:
+                raise FastbootError("Fastboot connection closed")
+            received += count
+        return bytes(buffer)
+
+    def _send_packet(self, data):
+        self._socket.sendall(struct.pack(">Q", len(data)))
+        self._socket.sendall(data)
+
+    def _recv_packet(self):
+        (length,) = struct.unpack(">Q", self._recv_exact(8))
+        return self._recv_exact(length)
+
+    def _command(self, command):
+        """
+        Sends a command and reads responses until OKAY, FAIL or DATA.
+
+        :return: Tuple of (status, payload, info_lines).
+        """
+        self._send_packet(command.encode())
+        return self._read_response(command)
+
+    def _read_response(self, command):
+        info = []
+        while True:
+            response = self._recv_packet()
+            status, payload = response[:4], response[4:].decode(errors="replace")
+            if status in (b"INFO", b"TEXT"):
+                info.append(payload)
+            elif status == b"FAIL":
+                raise FastbootError(f"{command} failed: {payload}")
+            elif status in (b"OKAY", b"DATA"):
+                return status, payload, info
+            else:
+                raise FastbootError(f"Unexpected fastboot response: {response!r}")
+
+    # --------------- Commands ---------------
+    def getvar(self, name):
+        if name not in self._vars:
+            _, value, _ = self._command(f"getvar:{name}")
+            self._vars[name] = value
+        return self._vars[name]
+
+    def getvar_all(self):
+        """Reads and caches every variable the bootloader reports."""
+        if self._have_all_vars:
+            return dict(self._vars)
+        _, _, info = self._command("getvar:all")
+        for line in info:
+            name, sep, value = line.rpartition(": ")
+            if sep:
+                self._vars[name.strip()] = value.strip()
+        self._have_all_vars = True
+        return dict(self._vars)
+
+    def max_download_size(self):
+        value = self.getvar("max-download-size")
+        try:
+            return int(value, 0)
+        except ValueError:
+            pass
+        try:
+            return int(value, 16)
+        except ValueError:
+            raise FastbootError(f"Unusable max-download-size: {value!r}")
+
+    def download(self, image_path):
+        size = os.path.getsize(image_path)
+        if size > self.max_download_size():
+            raise FastbootError(
+                f"{image_path} ({size} bytes) exceeds max-download-size; "
+                "sparse images are not supported by the native client"
+            )
+        status, payload, _ = self._command(f"download:{size:08x}")
+        try:
+            accepted = int(payload, 16)
+        except ValueError:
+            accepted = None
+        if status != b"DATA" or accepted != size:
+            raise FastbootError(f"Device rejected download of {size} bytes")
+
+        if size:
+            with open(image_path, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    view = memoryview(mapped)
+                    try:
+                        for offset in range(0, size, CHUNK_SIZE):
+                            self._send_packet(view[offset : offset + CHUNK_SIZE])
+                    finally:
+                        view.release()
+        self._read_response("download")
+        logging.info(f"Downloaded {image_path} ({size} bytes)")
+
+    def flash(self, partition, image_path=None):
+        if image_path is not None:
+            self.download(image_path)
+        self._command(f"flash:{partition}")
+        logging.info(f"Flashed {partition} partition over fastboot TCP")
+
+    def flash_all(self, images):
+        """
+        Flashes several partitions over this one connection.
+
+        :param images: Mapping or iterable of (partition, image_path) pairs.
+        """
+        items = images.items() if hasattr(images, "items") else images
+        for partition, image_path in items:
+            self.flash(partition, image_path)
+
+    def reboot(self, target=None):
+        self._command(REBOOT_COMMANDS[target])
+        logging.info(f"Rebooting device to {target or 'system'}")
+        self.close()
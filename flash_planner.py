@@ -0,0 +1,318 @@
+import json
+import logging
+import shlex
+import subprocess
+
+from device_manager import DeviceManager
+from state_manager import (
+    MODE_BOOTLOADER,
+    MODE_EDL,
+    MODE_RECOVERY,
+    MODE_SIDELOAD,
+    MODE_SYSTEM,
+    StateManager,
+)
+
+ADB_MODES = (MODE_SYSTEM, MODE_RECOVERY, MODE_SIDELOAD)
+
+# Named steps from workflows.json: (modes it can run in, partitions it writes).
+# A target set of None marks a barrier that is never reordered.
+WORKFLOW_STEPS = {
+    "boot_into_twrp": {"transition": MODE_RECOVERY},
+    "reboot": {"transition": MODE_SYSTEM},
+    "wipe_data": {"modes": (MODE_RECOVERY,), "targets": {"userdata"}},
+    "flash_magisk": {"modes": (MODE_RECOVERY,), "targets": None},
+    "flash_custom_rom": {"modes": (MODE_RECOVERY,), "targets": None},
+    "flash_gapps": {"modes": (MODE_RECOVERY,), "targets": None},
+    "decrypt_storage": {"modes": (MODE_RECOVERY,), "targets": None},
+    "backup_device": {"modes": (MODE_RECOVERY,), "targets": None},
+    "apply_ota_update": {"modes": (MODE_RECOVERY,), "targets": None},
+    "reflash_magisk_after_ota": {"modes": (MODE_RECOVERY,), "targets": None},
+    "restore_device": {"modes": (MODE_RECOVERY,), "targets": None},
+    "flash_boot_partition": {"modes": (MODE_BOOTLOADER,), "targets": {"boot"}},
+    "flash_vendor_partition": {"modes": (MODE_BOOTLOADER,), "targets": {"vendor"}},
+    "flash_system_partition": {"modes": (MODE_BOOTLOADER,), "targets": {"system"}},
+}
+
+REBOOT_TARGETS = {
+    "": MODE_SYSTEM,
+    "system": MODE_SYSTEM,
+    "bootloader": MODE_BOOTLOADER,
+    "recovery": MODE_RECOVERY,
+    "sideload": MODE_SIDELOAD,
+    "edl": MODE_EDL,
+}
+
+
+class PlanError(Exception):
+    """Raised when a step cannot be modelled or a mode cannot be reached."""
+
+
+def make_step(
+    name, modes=None, targets=None, command=None, transition=None, enters=None
+):
+    return {
+        "name": name,
+        "modes": tuple(modes or ()),
+        "targets": set(targets) if targets is not None else None,
+        "command": command,
+        "transition": transition,
+        "enters": enters,
+    }
+
+
+def parse_command(command):
+    """
+    Models an 'adb ...' or 'fastboot ...' command line as a plan step.
+
+    :param command: Command string such as 'fastboot flash recovery recovery.img'.
+    :return: Step dictionary.
+    """
+    args = shlex.split(command)
+    if not args or args[0] not in ("adb", "fastboot"):
+        raise PlanError(f"Cannot model command: {command}")
+    tool, rest = args[0], args[1:]
+    verb = rest[0] if rest else ""
+
+    if verb in ("reboot", "reboot-bootloader", "reboot-edl"):
+        target = verb.partition("-")[2] or (rest[1] if len(rest) > 1 else "")
+        if target not in REBOOT_TARGETS:
+            raise PlanError(f"Unknown reboot target in: {command}")
+        return make_step(command, command=args, transition=REBOOT_TARGETS[target])
+
+    if tool == "fastboot":
+        if verb in ("flash", "erase") and len(rest) > 1:
+            return make_step(command, (MODE_BOOTLOADER,), {rest[1]}, command=args)
+        if verb == "boot":
+            # Booting an image (usually TWRP) leaves the device in recovery.
+            return make_step(
+                command, (MODE_BOOTLOADER,), None, command=args, enters=MODE_RECOVERY
+            )
+        return make_step(command, (MODE_BOOTLOADER,), None, command=args)
+
+    if verb == "sideload":
+        # Recovery drops back to its menu once a sideload finishes.
+        return make_step(
+            command, (MODE_SIDELOAD,), None, command=args, enters=MODE_RECOVERY
+        )
+    if verb == "shell" and len(rest) > 1 and rest[1] == "twrp":
+        return make_step(command, (MODE_RECOVERY,), None, command=args)
+    return make_step(command, (MODE_SYSTEM, MODE_RECOVERY), None, command=args)
+
+
+def workflow_step(name):
+    spec = WORKFLOW_STEPS.get(name)
+    if spec is None:
+        raise PlanError(f"Unknown workflow step: {name}")
+    return make_step(name, **spec)
+
+
+def transition_commands(current, target):
+    """
+    Returns the reboot commands that move a device from one mode to another.
+
+    :return: List of (command, mode the device is in once it completes) pairs.
+    """
+    if current == target:
+        return []
+    if current == MODE_EDL:
+        raise PlanError("A device in EDL mode cannot be rebooted from the host")
+    if current == MODE_BOOTLOADER:
+        if target == MODE_SYSTEM:
+            return [(["fastboot", "reboot"], MODE_SYSTEM)]
+        if target == MODE_RECOVERY:
+            return [(["fastboot", "reboot", "recovery"], MODE_RECOVERY)]
+        if target == MODE_EDL:
+            return [(["fastboot", "oem", "edl"], MODE_EDL)]
+        return [
+            (["fastboot", "reboot", "recovery"], MODE_RECOVERY),
+            (["adb", "reboot", target], target),
+        ]
+    suffix = [] if target == MODE_SYSTEM else [target]
+    return [(["adb", "reboot", *suffix], target)]
+
+
+def _commutes(step, other):
+    return (
+        step["targets"] is not None
+        and other["targets"] is not None
+        and not step["targets"] & other["targets"]
+    )
+
+
+def count_naive_reboots(steps, start_mode):
+    """
+    Counts the reboots of running steps as written: every explicit reboot
+    fires, and any step needing another mode reboots into it.
+    """
+    current, reboots = start_mode, 0
+    for step in steps:
+        if step["transition"]:
+            reboots += 1
+            current = step["transition"]
+            continue
+        if current not in step["modes"]:
+            reboots += len(transition_commands(current, step["modes"][0]))
+            current = step["modes"][0]
+        current = step["enters"] or current
+    return reboots
+
+
+class FlashPlanner:
+    """
+    Orders flash steps so each device mode is entered as few times as possible.
+    Explicit reboots are dropped and regenerated from what each step needs;
+    steps writing disjoint partitions may be pulled forward to join a run of
+    steps in the same mode, while barrier steps keep their relative order.
+    """
+
+    reboot_timeout = 180
+
+    def __init__(self, serial=None, registry=None):
+        self.serial = serial
+        self.registry = registry
+
+    def detect_mode(self):
+        if self.registry is not None and self.serial:
+            record = self.registry.get(self.serial)
+            mode = record["mode"] if record else None
+            if mode in (MODE_SYSTEM, MODE_RECOVERY, MODE_SIDELOAD, MODE_BOOTLOADER):
+                StateManager.set_device_mode(mode, self.serial)
+                return mode
+        return DeviceManager.get_device_mode(self.serial)
+
+    @staticmethod
+    def steps_from_commands(commands):
+        return [parse_command(command) for command in commands]
+
+    @staticmethod
+    def steps_from_workflows(workflow_names, workflows_file="workflows.json"):
+        with open(workflows_file, "r") as f:
+            workflows = json.load(f)
+        return [
+            workflow_step(name)
+            for workflow in workflow_names
+            for name in workflows[workflow]
+        ]
+
+    def plan(self, steps, start_mode=None):
+        """
+        Builds an execution plan.
+
+        :param steps: Step dictionaries in their written order.
+        :param start_mode: Current device mode; detected when omitted.
+        :return: Dictionary with 'steps' plus naive, planned and saved reboot counts.
+        """
+        if start_mode is None:
+            start_mode = self.detect_mode()
+
+        final_mode = steps[-1]["transition"] if steps else None
+
+        remaining = [step for step in steps if not step["transition"]]
+        planned, current, reboots = [], start_mode, 0
+        while remaining:
+            pick = remaining[0]
+            if current not in pick["modes"]:
+                for index, step in enumerate(remaining[1:], start=1):
+                    if current in step["modes"] and all(
+                        _commutes(step, earlier) for earlier in remaining[:index]
+                    ):
+                        pick = step
+                        break
+            if current not in pick["modes"]:
+                reboots += self._append_transition(planned, current, pick["modes"][0])
+                current = pick["modes"][0]
+            planned.append(pick)
+            remaining.remove(pick)
+            current = pick["enters"] or current
+
+        if final_mode == MODE_EDL and steps[-1]["command"] and current != MODE_EDL:
+            # EDL entry is vendor specific; keep the user's own command for it.
+            command = steps[-1]["command"]
+            tool_modes = ADB_MODES if command[0] == "adb" else (MODE_BOOTLOADER,)
+            if current not in tool_modes:
+                reboots += self._append_transition(planned, current, tool_modes[0])
+            planned.append(steps[-1])
+            reboots += 1
+        elif final_mode and current != final_mode:
+            reboots += self._append_transition(planned, current, final_mode)
+
+        naive = count_naive_reboots(steps, start_mode)
+        return {
+            "start_mode": start_mode,
+            "steps": planned,
+            "naive_reboots": naive,
+            "planned_reboots": reboots,
+            "saved_reboots": max(0, naive - reboots),
+        }
+
+    @staticmethod
+    def _append_transition(planned, current, target):
+        commands = transition_commands(current, target)
+        for command, mode in commands:
+            planned.append(
+                make_step(
+                    " ".join(command),
+                    command=command,
+                    transition=mode,
+                )
+            )
+        return len(commands)
+
+    def execute(self, plan, runner=None):
+        """
+        Runs a plan, updating the device mode in StateManager as it goes.
+
+        :param runner: Callable taking a step, for steps without a command.
+        :return: True if every step succeeded.
+        """
+        logging.info(
+            f"Executing flash plan: {plan['planned_reboots']} reboots "
+            f"(saves {plan['saved_reboots']} of {plan['naive_reboots']})"
+        )
+        for step in plan["steps"]:
+            try:
+                if step["command"]:
+                    self._run_command(step["command"])
+                elif runner is not None:
+                    if runner(step) is False:
+                        raise PlanError(f"Step failed: {step['name']}")
+                else:
+                    raise PlanError(f"No runner for step: {step['name']}")
+                # Steps like 'fastboot boot twrp.img' return before the
+                # device is back, so wait for the mode they enter as well.
+                mode = step["transition"] or step["enters"]
+                if mode:
+                    self._wait_for(mode)
+            except (subprocess.CalledProcessError, OSError, PlanError) as e:
+                logging.error(f"Flash plan stopped at '{step['name']}': {e}")
+                return False
+            if mode:
+                StateManager.set_device_mode(mode, self.serial)
+            logging.info(f"Completed plan step: {step['name']}")
+        return True
+
+    def _wait_for(self, mode):
+        if mode == MODE_EDL:
+            # Neither adb nor fastboot can see a device in EDL mode.
+            logging.info("Device is entering EDL mode; not waiting for it.")
+            return
+        if self.registry is not None and self.serial:
+            record = self.registry.wait_for(
+                self.serial, mode, timeout=self.reboot_timeout
+            )
+            if record is None:
+                raise PlanError(
+                    f"{self.serial} did not reach {mode} "
+                    f"within {self.reboot_timeout} seconds"
+                )
+        elif mode in ADB_MODES:
+            # fastboot commands wait for the bootloader on their own
+            state = "device" if mode == MODE_SYSTEM else mode
+            self._run_command(["adb", f"wait-for-{state}"])
+
+    def _run_command(self, command):
+        tool, args = command[0], command[1:]
+        path = DeviceManager.ADB_PATH if tool == "adb" else DeviceManager.FASTBOOT_PATH
+        serial_args = ["-s", self.serial] if self.serial else []
+        subprocess.run([path, *serial_args, *args], check=True)
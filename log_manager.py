@@ -1,29 +1,182 @@
+import atexit
+import copy
+import gzip
 import logging
-from logging.handlers import RotatingFileHandler
+import os
+import queue
+import shutil
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+
+class TruncatingQueueHandler(QueueHandler):
+    """
+    Queue handler that caps message size before the record leaves the calling
+    thread. Oversized string arguments (getprop/dumpsys dumps) are cut down
+    before the message is formatted, so they are never rendered in full.
+    If the writer falls behind, records are dropped and counted instead of
+    blocking, and a summary record is queued once there is room again.
+    """
+
+    def __init__(self, log_queue, max_message_length):
+        super().__init__(log_queue)
+        self.max_message_length = max_message_length
+        self._dropped = 0
+        self._dropped_errors = 0
+        self._drop_lock = threading.Lock()
+
+    def _truncate(self, text):
+        if len(text) <= self.max_message_length:
+            return text
+        omitted = len(text) - self.max_message_length
+        lines = text.count("\n") + 1
+        return (
+            f"{text[: self.max_message_length]}"
+            f"... [truncated {omitted} chars, {lines} lines total]"
+        )
+
+    def prepare(self, record):
+        if isinstance(record.args, tuple) and any(
+            isinstance(arg, str) and len(arg) > self.max_message_length
+            for arg in record.args
+        ):
+            record = copy.copy(record)
+            record.args = tuple(
+                self._truncate(arg) if isinstance(arg, str) else arg
+                for arg in record.args
+            )
+        elif (
+            not record.args
+            and isinstance(record.msg, str)
+            and len(record.msg) > self.max_message_length
+        ):
+            record = copy.copy(record)
+            record.msg = self._truncate(record.msg)
+        record = super().prepare(record)
+        if len(record.msg) > 2 * self.max_message_length:
+            # Several large arguments can still add up; cap the final text too.
+            record.msg = record.message = self._truncate(record.msg)
+        return record
+
+    def enqueue(self, record):
+        # Drop rather than block if the writer ever falls behind.
+        with self._drop_lock:
+            if self._dropped:
+                summary = logging.makeLogRecord(
+                    {
+                        "name": "log_manager",
+                        "levelno": logging.WARNING,
+                        "levelname": "WARNING",
+                        "msg": (
+                            f"Log queue was full; dropped {self._dropped} records "
+                            f"({self._dropped_errors} at ERROR or above)"
+                        ),
+                    }
+                )
+                try:
+                    self.queue.put_nowait(summary)
+                    self._dropped = self._dropped_errors = 0
+                except queue.Full:
+                    pass
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self._dropped += 1
+                if record.levelno >= logging.ERROR:
+                    self._dropped_errors += 1
+
+
+class CompressingRotatingFileHandler(RotatingFileHandler):
+    """
+    Rotating file handler that gzips rotated files on a separate thread.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.namer = lambda name: name + ".gz"
+        self.rotator = self._rotate
+        self._compressor = None
+
+    def doRollover(self):
+        # Backups are renamed during rollover; let any pending compression finish first.
+        if self._compressor is not None:
+            self._compressor.join()
+        super().doRollover()
+
+    def _rotate(self, source, dest):
+        pending = dest + ".pending"
+        os.replace(source, pending)
+        self._compressor = threading.Thread(
+            target=self._compress, args=(pending, dest), daemon=True
+        )
+        self._compressor.start()
+
+    @staticmethod
+    def _compress(source, dest):
+        with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(source)
+
+    def close(self):
+        if self._compressor is not None:
+            self._compressor.join()
+        super().close()
 
 
 class LogManager:
     """
     Manages log configuration, log rotation, and custom log messages.
+    All records go through a queue so callers never block on file I/O;
+    a background listener writes them to a compressing rotating file.
     """
 
     log_file = "flash_tool.log"
     max_bytes = 5 * 1024 * 1024  # 5 MB
     backup_count = 3
+    max_message_length = 4096
+    queue_size = 10000
+    log_format = "%(asctime)s - %(levelname)s - %(message)s"
+
+    _listener = None
 
     @staticmethod
-    def configure_logger():
+    def configure_logger(level=logging.DEBUG):
+        if LogManager._listener is not None:
+            return LogManager._listener
+
         logger = logging.getLogger()
-        logger.setLevel(logging.DEBUG)
+        logger.setLevel(level)
 
-        # Create a rotating file handler
-        handler = RotatingFileHandler(
+        # Create a rotating file handler, driven by the queue listener thread
+        file_handler = CompressingRotatingFileHandler(
             LogManager.log_file,
             maxBytes=LogManager.max_bytes,
             backupCount=LogManager.backup_count,
         )
-        handler.setFormatter(
-            logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+        file_handler.setFormatter(logging.Formatter(LogManager.log_format))
+
+        log_queue = queue.Queue(LogManager.queue_size)
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        logger.addHandler(
+            TruncatingQueueHandler(log_queue, LogManager.max_message_length)
+        )
+
+        LogManager._listener = QueueListener(
+            log_queue, file_handler, respect_handler_level=True
         )
-        logger.addHandler(handler)
+        LogManager._listener.start()
+        atexit.register(LogManager.shutdown)
         logging.info("Log Manager configured successfully.")
+        return LogManager._listener
+
+    @staticmethod
+    def shutdown():
+        """Flush queued records and stop the background writer."""
+        listener = LogManager._listener
+        if listener is None:
+            return
+        LogManager._listener = None
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
@@ -1,5 +1,4 @@
 import logging
-import json
 from PyQt5 import QtWidgets, QtCore
 from PyQt5.QtWidgets import (
     QApplication,
@@ -12,19 +11,20 @@ from PyQt5.QtWidgets import (
 )
 import sys
 import subprocess
+import threading
+from device_catalog import DeviceCatalog
 from device_manager import DeviceManager
+from log_manager import LogManager
+from operation_queue import JOB_CANCELLED, JOB_FAILED, JOB_RUNNING, OperationQueue
 import warnings
 
-# Configure logging
-logging.basicConfig(
-    filename="flash_tool.log",
-    level=logging.DEBUG,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-)
-
 # Suppress DeprecationWarning
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
+# DeviceManager commands do not pass -s <serial>, so every job acts on the
+# device adb/fastboot picks by default and must share a single queue lane.
+ATTACHED_DEVICE = "attached device"
+
 
 # Function to log uncaught exceptions
 def exception_hook(exc_type, exc_value, exc_traceback):
@@ -61,12 +61,52 @@ class LogcatThread(QtCore.QThread):
         self.wait()
 
 
+class JobMonitor(QtCore.QObject):
+    """
+    Receives OperationQueue updates from worker threads and re-emits them on
+    the GUI thread once per interval, keeping only the latest state per job.
+    """
+
+    job_updated = QtCore.pyqtSignal(object)
+    job_finished = QtCore.pyqtSignal(object)
+
+    def __init__(self, interval_ms=100, parent=None):
+        super(JobMonitor, self).__init__(parent)
+        self._pending = {}
+        self._finished_ids = set()
+        self._lock = threading.Lock()
+        self._timer = QtCore.QTimer(self)
+        self._timer.timeout.connect(self.flush)
+        self._timer.start(interval_ms)
+
+    def post(self, job):
+        # Called from worker threads
+        with self._lock:
+            self._pending[job.id] = job
+
+    def flush(self):
+        with self._lock:
+            jobs = list(self._pending.values())
+            self._pending.clear()
+        for job in jobs:
+            if not job.finished:
+                self.job_updated.emit(job)
+            elif job.id not in self._finished_ids:
+                self._finished_ids.add(job.id)
+                self.job_finished.emit(job)
+
+
 class FlashTool(QMainWindow):
     def __init__(self):
         super(FlashTool, self).__init__()
-        self.config = load_config()  # Load config from 'config.json'
+        self.catalog = DeviceCatalog()  # Indexed profiles from 'config.json'
         self.device_profile = None
         self.logcat_thread = None
+        self.job_monitor = JobMonitor(parent=self)
+        self.job_monitor.job_updated.connect(self.on_job_updated)
+        self.job_monitor.job_finished.connect(self.on_job_finished)
+        self.operations = OperationQueue(on_update=self.job_monitor.post)
+        self._job_handlers = {}
         self.init_ui()
 
     def init_ui(self):
@@ -77,9 +117,15 @@ class FlashTool(QMainWindow):
         self.device_dropdown = QComboBox(self)
         self.device_dropdown.setGeometry(50, 50, 400, 30)
         self.device_dropdown.addItems(
-            self.config.keys()
+            self.catalog.profile_names()
         )  # Populate based on config.json
 
+        # Detect the connected device and select its profile
+        self.button_detect = QPushButton(self)
+        self.button_detect.setText("Detect Device")
+        self.button_detect.setGeometry(470, 50, 280, 30)
+        self.button_detect.clicked.connect(self.detect_device)
+
         # Progress bar
         self.progressBar = QProgressBar(self)
         self.progressBar.setGeometry(50, 400, 400, 30)
@@ -104,6 +150,12 @@ class FlashTool(QMainWindow):
         self.button_logcat.setGeometry(50, 370, 400, 30)
         self.button_logcat.clicked.connect(self.toggle_logcat)
 
+        # Cancel jobs still waiting in the queue
+        self.button_cancel = QPushButton(self)
+        self.button_cancel.setText("Cancel Queued Jobs")
+        self.button_cancel.setGeometry(470, 370, 280, 30)
+        self.button_cancel.clicked.connect(self.cancel_queued_jobs)
+
         # Log viewer
         self.log_viewer = QTextEdit(self)
         self.log_viewer.setGeometry(50, 410, 700, 150)
@@ -115,16 +167,99 @@ class FlashTool(QMainWindow):
         button.setGeometry(50, y_position, 400, 30)
         button.clicked.connect(function)
 
+    # --------------- Background Operations ---------------
+    def run_job(self, name, func, *args, on_done=None):
+        """Queues a device operation without blocking the UI."""
+        job = self.operations.submit(ATTACHED_DEVICE, name, func, *args)
+        if on_done is not None:
+            self._job_handlers[job.id] = on_done
+        self.statusBar().showMessage(f"Queued '{name}'")
+        return job
+
+    def notify_result(self, success_message, failure_message):
+        def handler(success):
+            if success:
+                QtWidgets.QMessageBox.information(self, "Info", success_message)
+            else:
+                QtWidgets.QMessageBox.critical(self, "Error", failure_message)
+
+        return handler
+
+    def on_job_updated(self, job):
+        if job.status == JOB_RUNNING:
+            # Device operations do not report progress; show a busy indicator.
+            self.progressBar.setRange(0, 0)
+        self.statusBar().showMessage(f"{job.name}: {job.status}")
+
+    def on_job_finished(self, job):
+        handler = self._job_handlers.pop(job.id, None)
+        if not self.operations.jobs():
+            self.progressBar.setRange(0, 100)
+            self.progressBar.setValue(0)
+        self.statusBar().showMessage(f"{job.name}: {job.status}")
+        if job.status == JOB_CANCELLED:
+            return
+        if job.status == JOB_FAILED:
+            QtWidgets.QMessageBox.critical(
+                self,
+                "Error",
+                f"{job.name} failed: {job.error}. Check logs for details.",
+            )
+            return
+        if handler is not None:
+            handler(job.result)
+
+    def cancel_queued_jobs(self):
+        cancelled = self.operations.cancel_device(ATTACHED_DEVICE)
+        self.statusBar().showMessage(f"Cancelled {cancelled} queued job(s)")
+
+    def closeEvent(self, event):
+        self.operations.shutdown(wait=False)
+        super(FlashTool, self).closeEvent(event)
+
+    # --------------- Button Handlers ---------------
+    def detect_device(self):
+        self.run_job(
+            "Detect Device",
+            DeviceManager.get_device_identity,
+            on_done=self.auto_select_profile,
+        )
+
+    def auto_select_profile(self, identity):
+        model, device = identity
+        # Pick up config.json edits made while the tool is open
+        if self.catalog.refresh():
+            self.device_dropdown.clear()
+            self.device_dropdown.addItems(self.catalog.profile_names())
+        name = self.catalog.match(model, device)
+        if name is None:
+            QtWidgets.QMessageBox.critical(
+                self, "Error", f"No profile matches {model or 'unknown'} ({device})."
+            )
+            return
+        self.device_dropdown.setCurrentText(name)
+        self.statusBar().showMessage(f"Selected profile {name} for {model}")
+
     def root_with_encryption(self):
-        DeviceManager.root_device(preserve_encryption=True)
-        QtWidgets.QMessageBox.information(
-            self, "Info", "Rooting completed with encryption preserved."
+        self.run_job(
+            "Root Device (Preserve Encryption)",
+            DeviceManager.root_device,
+            True,
+            on_done=self.notify_result(
+                "Rooting completed with encryption preserved.",
+                "Rooting failed. Check logs for details.",
+            ),
         )
 
     def root_without_encryption(self):
-        DeviceManager.root_device(preserve_encryption=False)
-        QtWidgets.QMessageBox.information(
-            self, "Info", "Rooting completed with encryption disabled."
+        self.run_job(
+            "Root Device (Disable Encryption)",
+            DeviceManager.root_device,
+            False,
+            on_done=self.notify_result(
+                "Rooting completed with encryption disabled.",
+                "Rooting failed. Check logs for details.",
+            ),
         )
 
     def install_custom_rom(self):
@@ -132,78 +267,90 @@ class FlashTool(QMainWindow):
             self, "Select Custom ROM ZIP", "", "Zip files (*.zip)"
         )[0]
         if rom_zip:
-            success = DeviceManager.flash_rom(rom_zip)
-            if success:
-                QtWidgets.QMessageBox.information(
-                    self, "Info", "Custom ROM installed successfully."
-                )
-            else:
-                QtWidgets.QMessageBox.critical(
-                    self,
-                    "Error",
+            profile = self.catalog.get_profile(self.device_dropdown.currentText()) or {}
+            self.run_job(
+                "Install Custom ROM",
+                DeviceManager.flash_rom,
+                rom_zip,
+                # Stock OTAs declare the device name, custom ROMs the codename.
+                [profile.get("codename"), *profile.get("aliases", [])],
+                on_done=self.notify_result(
+                    "Custom ROM installed successfully.",
                     "Custom ROM installation failed. Check logs for details.",
-                )
+                ),
+            )
 
     def flash_kernel(self):
         kernel_img = QFileDialog.getOpenFileName(
             self, "Select Custom Kernel Image", "", "Image files (*.img)"
         )[0]
         if kernel_img:
-            success = DeviceManager.flash_kernel(kernel_img)
-            if success:
-                QtWidgets.QMessageBox.information(
-                    self, "Info", "Custom kernel flashed successfully."
-                )
-            else:
-                QtWidgets.QMessageBox.critical(
-                    self, "Error", "Kernel flashing failed. Check logs for details."
-                )
+            self.run_job(
+                "Flash Custom Kernel",
+                DeviceManager.flash_kernel,
+                kernel_img,
+                on_done=self.notify_result(
+                    "Custom kernel flashed successfully.",
+                    "Kernel flashing failed. Check logs for details.",
+                ),
+            )
 
     def enter_rescue_mode(self):
-        success = DeviceManager.enter_rescue_mode()
-        if success:
-            QtWidgets.QMessageBox.information(
-                self, "Info", "Rescue mode completed successfully."
-            )
-        else:
-            QtWidgets.QMessageBox.critical(
-                self, "Error", "Failed to enter rescue mode. Check logs for details."
-            )
+        self.run_job(
+            "One-Click Rescue Mode",
+            DeviceManager.enter_rescue_mode,
+            on_done=self.notify_result(
+                "Rescue mode completed successfully.",
+                "Failed to enter rescue mode. Check logs for details.",
+            ),
+        )
 
     def backup_before_ota(self):
-        success = DeviceManager.backup_device()
-        if success:
-            QtWidgets.QMessageBox.information(
-                self, "Info", "Backup completed successfully."
-            )
-        else:
-            QtWidgets.QMessageBox.critical(
-                self, "Error", "Backup failed. Check logs for details."
-            )
+        self.run_job(
+            "Backup Before OTA Update",
+            DeviceManager.backup_device,
+            on_done=self.notify_result(
+                "Backup completed successfully.",
+                "Backup failed. Check logs for details.",
+            ),
+        )
 
     def apply_ota_update(self):
         ota_zip = QFileDialog.getOpenFileName(
             self, "Select OTA Update ZIP", "", "Zip files (*.zip)"
         )[0]
         if ota_zip:
-            success = DeviceManager.apply_ota_update(ota_zip)
-            if success:
-                magisk_installed = DeviceManager.reflash_magisk_after_ota()
-                if magisk_installed:
-                    QtWidgets.QMessageBox.information(
-                        self,
-                        "Info",
-                        "OTA Update applied and Magisk re-flashed successfully.",
-                    )
-                else:
-                    QtWidgets.QMessageBox.critical(
-                        self, "Error", "Magisk re-flashing failed. Root may be lost."
-                    )
-            else:
-                QtWidgets.QMessageBox.critical(
-                    self, "Error", "OTA Update failed. Restoring from backup."
-                )
-                DeviceManager.restore_device()
+            self.run_job(
+                "Apply OTA Update & Preserve Root",
+                self._apply_ota_and_reflash,
+                ota_zip,
+                on_done=self._on_ota_applied,
+            )
+
+    @staticmethod
+    def _apply_ota_and_reflash(ota_zip):
+        """Applies an OTA and re-flashes Magisk; restores the backup on failure."""
+        if not DeviceManager.apply_ota_update(ota_zip):
+            DeviceManager.restore_device()
+            return False, False
+        return True, DeviceManager.reflash_magisk_after_ota()
+
+    def _on_ota_applied(self, result):
+        ota_applied, magisk_installed = result
+        if not ota_applied:
+            QtWidgets.QMessageBox.critical(
+                self, "Error", "OTA Update failed. Restored from backup."
+            )
+        elif magisk_installed:
+            QtWidgets.QMessageBox.information(
+                self,
+                "Info",
+                "OTA Update applied and Magisk re-flashed successfully.",
+            )
+        else:
+            QtWidgets.QMessageBox.critical(
+                self, "Error", "Magisk re-flashing failed. Root may be lost."
+            )
 
     def toggle_logcat(self):
         if self.logcat_thread is None:
@@ -228,29 +375,10 @@ class FlashTool(QMainWindow):
         self.log_viewer.append(log_line)
 
 
-def load_config(config_file="config.json"):
-    try:
-        with open(config_file, "r") as f:
-            config = json.load(f)
-            logging.info(f"Loaded {config_file} successfully.")
-            return config
-    except FileNotFoundError:
-        logging.warning(f"{config_file} not found. Creating default config.")
-        default_config = {
-            "oneplus7pro": {
-                "twrp": "https://dl.twrp.me/guacamoleb/twrp-3.3.1-1-guacamoleb.img",
-                "magisk": "https://github.com/topjohnwu/Magisk/releases/latest",
-            }
-        }
-        with open(config_file, "w") as f:
-            json.dump(default_config, f, indent=4)
-        return default_config
-    except json.JSONDecodeError as e:
-        logging.error(f"Error decoding {config_file}: {e}")
-        return {}
-
-
 def application():
+    # Configured here rather than at import time, so processes that merely
+    # import this module never open their own handler on the log file.
+    LogManager.configure_logger()
     app = QApplication(sys.argv)
     window = FlashTool()
     window.show()
@@ -0,0 +1,150 @@
+import collections
+import itertools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINISHED_STATES = (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+
+class Job:
+    """
+    A device operation queued on an OperationQueue.
+    Only queued jobs can be cancelled; once a job is running it is left to
+    finish, since interrupting adb/fastboot mid-flash is worse than waiting.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, device, name, func, args, kwargs):
+        self.id = next(Job._ids)
+        self.device = device
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.status = JOB_QUEUED
+        self.result = None
+        self.error = None
+        self._queue = None
+
+    def cancel(self):
+        return self._queue.cancel(self) if self._queue else False
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.name} on {self.device}: {self.status}>"
+
+
+class OperationQueue:
+    """
+    Runs device operations on a worker pool.
+    Jobs for the same device run strictly in submission order, one at a time;
+    jobs for different devices run in parallel up to max_workers.
+    Every state change is passed to on_update(job) from the worker thread,
+    so GUI callers should marshal and throttle it.
+    """
+
+    def __init__(self, max_workers=4, on_update=None):
+        self.on_update = on_update
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="device-op"
+        )
+        self._queues = collections.defaultdict(collections.deque)
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def submit(self, device, name, func, *args, **kwargs):
+        job = Job(device, name, func, args, kwargs)
+        job._queue = self
+        with self._lock:
+            self._queues[device].append(job)
+            self._dispatch(device)
+        logging.info(f"Queued job {job.id} '{name}' for {device}")
+        self._notify(job)
+        return job
+
+    def cancel(self, job):
+        """Cancels a queued job. Returns False if it is already running or done."""
+        with self._lock:
+            queue = self._queues.get(job.device)
+            if job.status != JOB_QUEUED or queue is None or job not in queue:
+                return False
+            queue.remove(job)
+            job.status = JOB_CANCELLED
+        logging.info(f"Cancelled queued job {job.id} '{job.name}'")
+        self._notify(job)
+        return True
+
+    def cancel_device(self, device):
+        """Cancels every queued job for a device; a running job is left to finish."""
+        with self._lock:
+            jobs = list(self._queues.get(device, ()))
+        return sum(1 for job in jobs if self.cancel(job))
+
+    def jobs(self, device=None):
+        with self._lock:
+            running = [
+                job
+                for key, job in self._running.items()
+                if device is None or key == device
+            ]
+            queued = [
+                job
+                for key, queue in self._queues.items()
+                if device is None or key == device
+                for job in queue
+            ]
+        return running + queued
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            devices = list(self._queues)
+        for device in devices:
+            self.cancel_device(device)
+        self._executor.shutdown(wait=wait)
+
+    def _dispatch(self, device):
+        # Caller holds self._lock.
+        if device in self._running:
+            return
+        queue = self._queues.get(device)
+        if not queue:
+            self._queues.pop(device, None)
+            return
+        job = queue.popleft()
+        job.status = JOB_RUNNING
+        self._running[device] = job
+        self._executor.submit(self._run, job)
+
+    def _run(self, job):
+        self._notify(job)
+        try:
+            job.result = job.func(*job.args, **job.kwargs)
+            job.status = JOB_DONE
+        except Exception as e:
+            logging.exception(f"Job {job.id} '{job.name}' failed.")
+            job.error = e
+            job.status = JOB_FAILED
+        finally:
+            with self._lock:
+                del self._running[job.device]
+                self._dispatch(job.device)
+            logging.info(f"Job {job.id} '{job.name}' finished: {job.status}")
+            self._notify(job)
+
+    def _notify(self, job):
+        if self.on_update is None:
+            return
+        try:
+            self.on_update(job)
+        except Exception:
+            logging.exception("Operation queue update callback failed.")
@@ -0,0 +1,378 @@
+import bz2
+import hashlib
+import logging
+import lzma
+import mmap
+import os
+import struct
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+PAYLOAD_MAGIC = b"CrAU"
+PAYLOAD_MEMBER = "payload.bin"
+DEFAULT_BLOCK_SIZE = 4096
+
+# InstallOperation.Type values from update_engine's update_metadata.proto
+OP_REPLACE = 0
+OP_REPLACE_BZ = 1
+OP_ZERO = 6
+OP_DISCARD = 7
+OP_REPLACE_XZ = 8
+
+OP_NAMES = {
+    OP_REPLACE: "REPLACE",
+    OP_REPLACE_BZ: "REPLACE_BZ",
+    OP_ZERO: "ZERO",
+    OP_DISCARD: "DISCARD",
+    OP_REPLACE_XZ: "REPLACE_XZ",
+}
+
+# Operations per worker task; keeps large partitions spread across the pool
+# without paying a scheduling round trip for every single operation.
+OPS_PER_TASK = 64
+ZERO_CHUNK = b"\0" * (1024 * 1024)
+
+
+class PayloadError(Exception):
+    """Raised when a payload is malformed or fails verification."""
+
+
+# --------------- Protobuf Decoding ---------------
+def _read_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _iter_fields(buf):
+    """
+    Yields (field_number, wire_type, value) for every field of a protobuf message.
+    Length-delimited values are returned as bytes; varints as ints.
+    """
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = _read_varint(buf, pos)
+        field, wire_type = key >> 3, key & 0x07
+        if wire_type == 0:
+            value, pos = _read_varint(buf, pos)
+        elif wire_type == 1:
+            value = struct.unpack_from("<Q", buf, pos)[0]
+            pos += 8
+        elif wire_type == 2:
+            length, pos = _read_varint(buf, pos)
+            if pos + length > end:
+                raise PayloadError("Truncated protobuf field")
+            value = bytes(buf[pos : pos + length])
+            pos += length
+        elif wire_type == 5:
+            value = struct.unpack_from("<I", buf, pos)[0]
+            pos += 4
+        else:
+            raise PayloadError(f"Unsupported protobuf wire type {wire_type}")
+        yield field, wire_type, value
+
+
+def _parse_extent(buf):
+    start_block = num_blocks = 0
+    for field, _, value in _iter_fields(buf):
+        if field == 1:
+            start_block = value
+        elif field == 2:
+            num_blocks = value
+    return start_block, num_blocks
+
+
+def _parse_operation(buf):
+    op = {
+        "type": None,
+        "data_offset": 0,
+        "data_length": 0,
+        "dst_extents": [],
+        "data_sha256": None,
+    }
+    for field, _, value in _iter_fields(buf):
+        if field == 1:
+            op["type"] = value
+        elif field == 2:
+            op["data_offset"] = value
+        elif field == 3:
+            op["data_length"] = value
+        elif field == 6:
+            op["dst_extents"].append(_parse_extent(value))
+        elif field == 8:
+            op["data_sha256"] = value
+    return op
+
+
+def _parse_partition_info(buf):
+    size, digest = 0, None
+    for field, _, value in _iter_fields(buf):
+        if field == 1:
+            size = value
+        elif field == 2:
+            digest = value
+    return size, digest
+
+
+def _parse_partition(buf):
+    partition = {"name": None, "size": 0, "hash": None, "operations": []}
+    for field, _, value in _iter_fields(buf):
+        if field == 1:
+            partition["name"] = value.decode()
+        elif field == 7:
+            partition["size"], partition["hash"] = _parse_partition_info(value)
+        elif field == 8:
+            partition["operations"].append(_parse_operation(value))
+    return partition
+
+
+def parse_manifest(buf):
+    """
+    Decodes the subset of DeltaArchiveManifest needed for full payloads.
+
+    :param buf: Serialized manifest bytes.
+    :return: Dictionary with 'block_size', 'minor_version' and 'partitions'.
+    """
+    manifest = {"block_size": DEFAULT_BLOCK_SIZE, "minor_version": 0, "partitions": []}
+    try:
+        for field, _, value in _iter_fields(buf):
+            if field == 3:
+                manifest["block_size"] = value
+            elif field == 12:
+                manifest["minor_version"] = value
+            elif field == 13:
+                manifest["partitions"].append(_parse_partition(value))
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise PayloadError(f"Malformed payload manifest: {e}")
+    return manifest
+
+
+# --------------- Payload Location ---------------
+def locate_payload(path):
+    """
+    Finds the byte range of payload.bin inside an OTA zip, or of a bare payload.bin.
+    The member must be stored uncompressed so it can be mapped in place.
+
+    :param path: Path to an OTA zip or a payload.bin file.
+    :return: Tuple of (offset, length) within the file.
+    """
+    if not zipfile.is_zipfile(path):
+        return 0, os.path.getsize(path)
+
+    with zipfile.ZipFile(path) as archive:
+        try:
+            info = archive.getinfo(PAYLOAD_MEMBER)
+        except KeyError:
+            raise PayloadError(f"{path} does not contain {PAYLOAD_MEMBER}")
+        if info.compress_type != zipfile.ZIP_STORED:
+            raise PayloadError(
+                f"{PAYLOAD_MEMBER} in {path} is compressed and cannot be mapped"
+            )
+        with open(path, "rb") as f:
+            f.seek(info.header_offset)
+            header = f.read(30)
+        if header[:4] != b"PK\x03\x04":
+            raise PayloadError(f"Bad local file header for {PAYLOAD_MEMBER}")
+        name_len, extra_len = struct.unpack_from("<HH", header, 26)
+        return info.header_offset + 30 + name_len + extra_len, info.file_size
+
+
+def read_payload_header(view):
+    """
+    Parses the payload header and manifest from a mapped payload.
+
+    :param view: Buffer positioned at the start of payload.bin.
+    :return: Tuple of (manifest, data_offset).
+    """
+    if bytes(view[:4]) != PAYLOAD_MAGIC:
+        raise PayloadError("Not an update_engine payload (bad magic)")
+    if len(view) < 24:
+        raise PayloadError("Payload header is truncated")
+    version, manifest_size = struct.unpack_from(">QQ", view, 4)
+    if version == 1:
+        header_size, signature_size = 20, 0
+    elif version == 2:
+        header_size = 24
+        signature_size = struct.unpack_from(">I", view, 20)[0]
+    else:
+        raise PayloadError(f"Unsupported payload version {version}")
+    data_offset = header_size + manifest_size + signature_size
+    if data_offset > len(view):
+        raise PayloadError(
+            f"Payload is truncated: manifest and signature need {data_offset} bytes, "
+            f"only {len(view)} present"
+        )
+    with view[header_size : header_size + manifest_size] as manifest_view:
+        manifest = parse_manifest(manifest_view)
+    data_size = len(view) - data_offset
+    for partition in manifest["partitions"]:
+        for op in partition["operations"]:
+            if op["data_offset"] + op["data_length"] > data_size:
+                raise PayloadError(
+                    f"Operation data for {partition['name']} at offset "
+                    f"{op['data_offset']} lies beyond end of payload"
+                )
+    return manifest, data_offset
+
+
+# --------------- Worker Functions ---------------
+def _apply_operations(payload_path, base, output_path, block_size, operations):
+    """
+    Runs in a worker thread: maps the payload and writes a batch of operations
+    into the output image at their destination extents. Hashing and
+    decompression release the GIL, so batches run in parallel.
+    """
+    with open(payload_path, "rb") as src, open(output_path, "r+b") as dst:
+        with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for op in operations:
+                op_type = op["type"]
+                if op_type in (OP_ZERO, OP_DISCARD):
+                    for start, count in op["dst_extents"]:
+                        dst.seek(start * block_size)
+                        remaining = count * block_size
+                        while remaining:
+                            chunk = min(remaining, len(ZERO_CHUNK))
+                            dst.write(ZERO_CHUNK[:chunk])
+                            remaining -= chunk
+                    continue
+
+                begin = base + op["data_offset"]
+                blob = mapped[begin : begin + op["data_length"]]
+                if op["data_sha256"] and (
+                    hashlib.sha256(blob).digest() != op["data_sha256"]
+                ):
+                    raise PayloadError(
+                        f"Data hash mismatch for operation at offset {op['data_offset']}"
+                    )
+                if op_type == OP_REPLACE_XZ:
+                    blob = lzma.decompress(blob)
+                elif op_type == OP_REPLACE_BZ:
+                    blob = bz2.decompress(blob)
+                elif op_type != OP_REPLACE:
+                    raise PayloadError(
+                        f"Operation type {op_type} requires a source image"
+                    )
+
+                position = 0
+                for start, count in op["dst_extents"]:
+                    length = count * block_size
+                    dst.seek(start * block_size)
+                    dst.write(blob[position : position + length])
+                    position += length
+    return len(operations)
+
+
+def _hash_image(output_path):
+    sha256_hash = hashlib.sha256()
+    with open(output_path, "rb") as f:
+        for byte_block in iter(lambda: f.read(1024 * 1024), b""):
+            sha256_hash.update(byte_block)
+    return sha256_hash.digest()
+
+
+class PayloadExtractor:
+    """
+    Extracts partition images from a full A/B OTA payload.bin.
+    Operations are applied in parallel across a thread pool straight from
+    a memory-mapped OTA zip, and each image is checked against the manifest.
+    """
+
+    def __init__(self, ota_path, max_workers=None):
+        self.ota_path = ota_path
+        self.max_workers = max_workers
+        self.base_offset, self.payload_size = locate_payload(ota_path)
+        with open(ota_path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                # Both views must be released before the mmap closes, even
+                # when parsing fails, or the real error is masked by BufferError.
+                with memoryview(mapped) as view, view[
+                    self.base_offset : self.base_offset + self.payload_size
+                ] as payload:
+                    if len(payload) != self.payload_size:
+                        raise PayloadError(f"{ota_path} is truncated")
+                    self.manifest, data_offset = read_payload_header(payload)
+        self.data_offset = self.base_offset + data_offset
+
+    @property
+    def partitions(self):
+        return [p["name"] for p in self.manifest["partitions"]]
+
+    def extract(self, output_dir, partitions=None, verify=True):
+        """
+        Writes the selected partitions to '<output_dir>/<name>.img'.
+
+        :param output_dir: Directory to write partition images to.
+        :param partitions: Optional iterable of partition names; defaults to all.
+        :param verify: Check each image against the manifest's SHA-256 hash.
+        :return: Dictionary mapping partition name to image path.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        wanted = set(partitions) if partitions else None
+        selected = [
+            p
+            for p in self.manifest["partitions"]
+            if wanted is None or p["name"] in wanted
+        ]
+        if wanted:
+            missing = wanted - {p["name"] for p in selected}
+            if missing:
+                raise PayloadError(f"Partitions not in payload: {sorted(missing)}")
+
+        block_size = self.manifest["block_size"]
+        images = {}
+        for partition in selected:
+            image_path = os.path.join(output_dir, f"{partition['name']}.img")
+            size = partition["size"] or block_size * sum(
+                count for op in partition["operations"] for _, count in op["dst_extents"]
+            )
+            with open(image_path, "wb") as f:
+                f.truncate(size)
+            images[partition["name"]] = image_path
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {}
+            for partition in selected:
+                ops = partition["operations"]
+                for i in range(0, len(ops), OPS_PER_TASK):
+                    future = pool.submit(
+                        _apply_operations,
+                        self.ota_path,
+                        self.data_offset,
+                        images[partition["name"]],
+                        block_size,
+                        ops[i : i + OPS_PER_TASK],
+                    )
+                    futures[future] = partition["name"]
+            for future in as_completed(futures):
+                future.result()
+            logging.info(
+                "Applied payload operations for %d partitions from %s",
+                len(selected),
+                self.ota_path,
+            )
+
+            if verify:
+                self._verify(pool, selected, images)
+        return images
+
+    @staticmethod
+    def _verify(pool, selected, images):
+        futures = {
+            pool.submit(_hash_image, images[p["name"]]): p
+            for p in selected
+            if p["hash"]
+        }
+        for future in as_completed(futures):
+            partition = futures[future]
+            if future.result() != partition["hash"]:
+                raise PayloadError(
+                    f"Hash mismatch for extracted partition {partition['name']}"
+                )
+            logging.info("Verified partition image: %s", partition["name"])
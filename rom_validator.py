@@ -0,0 +1,339 @@
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+INSTALLER_ENTRIES = ("META-INF/com/google/android/update-binary", "payload.bin")
+PAYLOAD_ENTRIES = (
+    "payload.bin",
+    "system.new.dat.br",
+    "system.new.dat",
+    "system.img",
+    "system.transfer.list",
+)
+METADATA_ENTRY = "META-INF/com/android/metadata"
+UPDATER_SCRIPT_ENTRY = "META-INF/com/google/android/updater-script"
+
+DEVICE_ASSERT = re.compile(
+    r'getprop\("ro\.(?:product|build\.product)\.device"\)\s*==\s*"([^"]+)"'
+)
+
+CACHE_FILE = ".rom_validation_cache.json"
+BATCH_BYTES = 64 * 1024 * 1024
+READ_CHUNK = 4 * 1024 * 1024
+
+EOCD_SIGNATURE = b"PK\x05\x06"
+EOCD64_LOCATOR_SIGNATURE = b"PK\x06\x07"
+CENTRAL_SIGNATURE = b"PK\x01\x02"
+LOCAL_SIGNATURE = b"PK\x03\x04"
+STORED, DEFLATED = 0, 8
+
+
+class ZipStructureError(Exception):
+    """Raised when the zip's directory structure is missing or inconsistent."""
+
+
+# --------------- Central Directory Parsing ---------------
+def _find_eocd(mapped):
+    start = max(0, len(mapped) - 22 - 0xFFFF)
+    position = mapped.rfind(EOCD_SIGNATURE, start)
+    if position < 0:
+        raise ZipStructureError("End of central directory not found (truncated?)")
+    return position
+
+
+def read_central_directory(mapped):
+    """
+    Parses the central directory of a memory-mapped zip, including zip64.
+
+    :return: List of entry dictionaries.
+    """
+    eocd = _find_eocd(mapped)
+    count, cd_size, cd_offset = struct.unpack_from("<HII", mapped, eocd + 10)
+    locator = eocd - 20
+    if locator >= 0 and mapped[locator : locator + 4] == EOCD64_LOCATOR_SIGNATURE:
+        (eocd64,) = struct.unpack_from("<Q", mapped, locator + 8)
+        count, cd_size, cd_offset = struct.unpack_from("<QQQ", mapped, eocd64 + 32)
+    if cd_offset + cd_size > len(mapped):
+        raise ZipStructureError("Central directory lies beyond end of file")
+
+    entries = []
+    position = cd_offset
+    for _ in range(count):
+        if mapped[position : position + 4] != CENTRAL_SIGNATURE:
+            raise ZipStructureError(f"Bad central directory record at {position}")
+        (
+            method,
+            crc,
+            compressed_size,
+            file_size,
+            name_len,
+            extra_len,
+            comment_len,
+        ) = struct.unpack_from("<H4xIIIHHH", mapped, position + 10)
+        (header_offset,) = struct.unpack_from("<I", mapped, position + 42)
+        name = mapped[position + 46 : position + 46 + name_len].decode(
+            "utf-8", "replace"
+        )
+        extra = mapped[
+            position + 46 + name_len : position + 46 + name_len + extra_len
+        ]
+        file_size, compressed_size, header_offset = _apply_zip64_extra(
+            extra, file_size, compressed_size, header_offset
+        )
+        entries.append(
+            {
+                "name": name,
+                "method": method,
+                "crc": crc,
+                "compressed_size": compressed_size,
+                "file_size": file_size,
+                "header_offset": header_offset,
+            }
+        )
+        position += 46 + name_len + extra_len + comment_len
+    return entries
+
+
+def _apply_zip64_extra(extra, file_size, compressed_size, header_offset):
+    position = 0
+    while position + 4 <= len(extra):
+        tag, size = struct.unpack_from("<HH", extra, position)
+        if tag == 0x0001:
+            values = iter(struct.unpack_from(f"<{size // 8}Q", extra, position + 4))
+            if file_size == 0xFFFFFFFF:
+                file_size = next(values)
+            if compressed_size == 0xFFFFFFFF:
+                compressed_size = next(values)
+            if header_offset == 0xFFFFFFFF:
+                header_offset = next(values)
+            break
+        position += 4 + size
+    return file_size, compressed_size, header_offset
+
+
+def _data_offset(mapped, entry):
+    offset = entry["header_offset"]
+    if mapped[offset : offset + 4] != LOCAL_SIGNATURE:
+        raise ZipStructureError(f"Bad local header for {entry['name']}")
+    name_len, extra_len = struct.unpack_from("<HH", mapped, offset + 26)
+    start = offset + 30 + name_len + extra_len
+    if start + entry["compressed_size"] > len(mapped):
+        raise ZipStructureError(
+            f"{entry['name']} extends past end of file (truncated?)"
+        )
+    return start
+
+
+def _read_entry(mapped, entry):
+    start = _data_offset(mapped, entry)
+    data = mapped[start : start + entry["compressed_size"]]
+    if entry["method"] == DEFLATED:
+        return zlib.decompress(data, -15)
+    return data
+
+
+# --------------- Worker Functions ---------------
+def _crc_entries(path, entries):
+    """
+    Runs in a worker thread: recomputes the CRC-32 of a batch of entries
+    straight from the mapped file and returns the names that do not match.
+    zlib releases the GIL on large buffers, so batches run in parallel.
+    """
+    failures = []
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for entry in entries:
+                try:
+                    crc = _entry_crc(mapped, entry)
+                except (ZipStructureError, zlib.error) as e:
+                    failures.append(f"{entry['name']}: {e}")
+                    continue
+                if crc != entry["crc"]:
+                    failures.append(f"{entry['name']}: CRC mismatch")
+    return failures
+
+
+def _entry_crc(mapped, entry):
+    start = _data_offset(mapped, entry)
+    end = start + entry["compressed_size"]
+    if entry["method"] == STORED:
+        decompressor = None
+    elif entry["method"] == DEFLATED:
+        decompressor = zlib.decompressobj(-15)
+    else:
+        raise ZipStructureError(f"unsupported compression method {entry['method']}")
+
+    crc = 0
+    view = memoryview(mapped)
+    try:
+        for position in range(start, end, READ_CHUNK):
+            chunk = view[position : min(position + READ_CHUNK, end)]
+            if decompressor is None:
+                crc = zlib.crc32(chunk, crc)
+            else:
+                crc = zlib.crc32(decompressor.decompress(chunk), crc)
+            chunk.release()
+        if decompressor is not None:
+            crc = zlib.crc32(decompressor.flush(), crc)
+    finally:
+        view.release()
+    return crc
+
+
+def _batch_entries(entries):
+    """Groups entries into roughly BATCH_BYTES-sized batches, largest first."""
+    batches, current, size = [], [], 0
+    for entry in sorted(entries, key=lambda e: e["compressed_size"], reverse=True):
+        current.append(entry)
+        size += entry["compressed_size"]
+        if size >= BATCH_BYTES:
+            batches.append(current)
+            current, size = [], 0
+    if current:
+        batches.append(current)
+    return batches
+
+
+# --------------- Device Detection ---------------
+def detect_target_devices(mapped, entries):
+    """
+    Reads the device codenames a ROM/OTA declares it is built for.
+
+    :return: Set of codenames, empty if the zip does not say.
+    """
+    by_name = {entry["name"]: entry for entry in entries}
+    devices = set()
+    if METADATA_ENTRY in by_name:
+        metadata = _read_entry(mapped, by_name[METADATA_ENTRY]).decode(
+            errors="replace"
+        )
+        for line in metadata.splitlines():
+            key, _, value = line.partition("=")
+            if key.strip() == "pre-device":
+                devices.update(v.strip() for v in value.split(",") if v.strip())
+    if not devices and UPDATER_SCRIPT_ENTRY in by_name:
+        script = _read_entry(mapped, by_name[UPDATER_SCRIPT_ENTRY]).decode(
+            errors="replace"
+        )
+        devices.update(DEVICE_ASSERT.findall(script))
+    return devices
+
+
+class RomValidator:
+    """
+    Pre-flight checks for ROM/OTA zips before they are sideloaded.
+    The zip is memory-mapped and its central directory parsed in place;
+    entry CRCs are recomputed across a thread pool. Results are cached
+    by file identity (path, size, mtime, inode) so repeat checks are free.
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, cache_file=CACHE_FILE, max_workers=None):
+        self.cache_file = cache_file
+        self.max_workers = max_workers
+        self._cache = self._load_cache()
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_file, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_cache(self):
+        try:
+            with open(self.cache_file, "w") as f:
+                json.dump(self._cache, f, indent=4)
+        except OSError as e:
+            logging.warning(f"Failed to save validation cache: {e}")
+
+    @staticmethod
+    def _identity(path):
+        stat = os.stat(path)
+        return "|".join(
+            str(part)
+            for part in (
+                os.path.abspath(path),
+                stat.st_size,
+                stat.st_mtime_ns,
+                stat.st_ino,
+            )
+        )
+
+    def validate(self, path, codenames=None):
+        """
+        Validates a ROM/OTA zip.
+
+        :param path: Path to the zip.
+        :param codenames: Codename or list of codenames the zip must target.
+        :return: Dictionary with 'valid', 'errors', 'warnings' and 'devices'.
+        """
+        try:
+            identity = self._identity(path)
+        except OSError as e:
+            return {"valid": False, "errors": [str(e)], "warnings": [], "devices": []}
+
+        with RomValidator._lock:
+            cached = self._cache.get(identity)
+        if cached is not None:
+            logging.info(f"Using cached validation result for {path}")
+            result = dict(cached, errors=list(cached["errors"]))
+        else:
+            result = self._validate_archive(path)
+            with RomValidator._lock:
+                self._cache[identity] = result
+                self._save_cache()
+            result = dict(result, errors=list(result["errors"]))
+
+        warnings = []
+        if isinstance(codenames, str):
+            codenames = [codenames]
+        codenames = [codename for codename in codenames or () if codename]
+        if codenames:
+            if not result["devices"]:
+                warnings.append("Zip does not declare a target device")
+            elif not set(codenames) & set(result["devices"]):
+                result["errors"].append(
+                    f"Zip targets {', '.join(result['devices'])}, "
+                    f"not {', '.join(codenames)}"
+                )
+        result["warnings"] = warnings
+        result["valid"] = not result["errors"]
+        return result
+
+    def _validate_archive(self, path):
+        errors = []
+        try:
+            with open(path, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    entries = read_central_directory(mapped)
+                    devices = sorted(detect_target_devices(mapped, entries))
+        except (OSError, ValueError, ZipStructureError, zlib.error, struct.error) as e:
+            return {"errors": [f"Unreadable zip: {e}"], "devices": []}
+
+        names = {entry["name"] for entry in entries}
+        if not names & set(INSTALLER_ENTRIES):
+            errors.append(f"Missing installer: one of {', '.join(INSTALLER_ENTRIES)}")
+        if not names & set(PAYLOAD_ENTRIES):
+            errors.append(f"Missing payload: one of {', '.join(PAYLOAD_ENTRIES)}")
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [
+                pool.submit(_crc_entries, path, batch)
+                for batch in _batch_entries(entries)
+            ]
+            for future in futures:
+                errors.extend(future.result())
+
+        if errors:
+            logging.error(f"Validation of {path} failed: {errors}")
+        else:
+            logging.info(f"Validated {path}: {len(entries)} entries OK")
+        return {"errors": errors, "devices": devices}
@@ -0,0 +1,249 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+
+PROBE_BYTES = 256 * 1024
+# Small reads so the throughput window is checked often even on a slow trickle.
+CHUNK_SIZE = 16 * 1024
+
+
+class StallError(Exception):
+    """Raised when a source stops delivering data at a useful rate."""
+
+
+def candidate_urls(entry):
+    """
+    Lists the HTTP(S) URLs an artifact entry from config.json can be fetched from.
+
+    :param entry: URL string, or a dict with 'url', 'repo_url' and/or 'mirrors'.
+    :return: De-duplicated list of URLs in config order.
+    """
+    if isinstance(entry, str):
+        candidates = [entry]
+    else:
+        candidates = [entry.get("url"), entry.get("repo_url")]
+        candidates += entry.get("mirrors", [])
+    urls = []
+    for url in candidates:
+        if url and urlparse(url).scheme in ("http", "https") and url not in urls:
+            urls.append(url)
+    return urls
+
+
+def _parse_total_size(response):
+    content_range = response.headers.get("Content-Range", "")
+    if "/" in content_range:
+        total = content_range.rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else None
+    length = response.headers.get("Content-Length")
+    if response.status_code == 200 and length and length.isdigit():
+        return int(length)
+    return None
+
+
+class ThroughputHistory:
+    """
+    Per-host throughput estimates that decay over time, so a mirror that was
+    fast this morning does not keep winning once it slows down.
+    """
+
+    half_life = 3600.0
+
+    def __init__(self):
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def record(self, host, bytes_per_second, now=None):
+        now = now or time.time()
+        with self._lock:
+            estimate, weight, updated = self._hosts.get(host, (0.0, 0.0, now))
+            decayed = weight * 0.5 ** ((now - updated) / self.half_life)
+            total = decayed + 1.0
+            estimate = (estimate * decayed + bytes_per_second) / total
+            self._hosts[host] = (estimate, total, now)
+
+    def estimate(self, host):
+        with self._lock:
+            entry = self._hosts.get(host)
+            return entry[0] if entry else None
+
+
+_shared_history = ThroughputHistory()
+
+
+class SourceSelector:
+    """
+    Races the candidate URLs of an artifact with small range requests and
+    downloads from the fastest one. If the active source stalls mid-transfer,
+    the download resumes from the next best source at the same offset.
+    """
+
+    probe_timeout = 10.0
+    stall_timeout = 15.0
+    stall_window = 5.0
+    min_throughput = 16 * 1024  # bytes per second over stall_window
+
+    def __init__(self, history=None, max_workers=8):
+        self.history = history or _shared_history
+        self.max_workers = max_workers
+
+    # --------------- Probing ---------------
+    def _probe(self, url):
+        host = urlparse(url).netloc
+        started = time.monotonic()
+        try:
+            with requests.get(
+                url,
+                headers={"Range": f"bytes=0-{PROBE_BYTES - 1}"},
+                stream=True,
+                timeout=self.probe_timeout,
+            ) as response:
+                response.raise_for_status()
+                received = 0
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    received += len(chunk)
+                    if received >= PROBE_BYTES:
+                        break
+                    if time.monotonic() - started > self.probe_timeout:
+                        break
+                elapsed = max(time.monotonic() - started, 1e-6)
+                self.history.record(host, received / elapsed)
+                return {
+                    "url": url,
+                    "supports_range": response.status_code == 206,
+                    "total_size": _parse_total_size(response),
+                }
+        except requests.RequestException as e:
+            logging.warning(f"Probe of {url} failed: {e}")
+            self.history.record(host, 0.0)
+            return None
+
+    def _score(self, source):
+        return self.history.estimate(urlparse(source["url"]).netloc) or 0.0
+
+    def rank(self, urls):
+        """
+        Probes every URL concurrently.
+
+        :return: Reachable sources, fastest first by decayed throughput history.
+        """
+        workers = min(self.max_workers, len(urls) or 1)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            sources = [source for source in pool.map(self._probe, urls) if source]
+        sources.sort(key=self._score, reverse=True)
+        logging.info(f"Ranked sources: {[source['url'] for source in sources]}")
+        return sources
+
+    # --------------- Downloading ---------------
+    def download(self, urls, destination, expected_md5=None):
+        """
+        Downloads an artifact from the fastest of several URLs.
+
+        :param urls: Candidate URLs serving the same file.
+        :param destination: Path to write the file to.
+        :param expected_md5: Optional MD5 hex digest to verify against.
+        :return: The destination path.
+        """
+        sources = self.rank(urls)
+        if not sources:
+            raise requests.ConnectionError(f"No reachable source among {urls}")
+
+        partial = destination + ".part"
+        try:
+            offset = self._download_to(sources, partial)
+            if expected_md5 and self._md5(partial) != expected_md5.lower():
+                raise ValueError(f"MD5 mismatch for {destination}")
+        except Exception:
+            # Never leave a partial file behind for the next attempt to trust.
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+        os.replace(partial, destination)
+        logging.info(f"Downloaded {destination} ({offset} bytes)")
+        return destination
+
+    def _download_to(self, sources, partial):
+        offset, total_size, tried = 0, sources[0]["total_size"], set()
+        with open(partial, "wb") as f:
+            for _ in range(len(sources) * 2):
+                # Every source gets a turn before a stalled one is retried.
+                untried = [s for s in sources if s["url"] not in tried]
+                if not untried:
+                    tried.clear()
+                    untried = sources
+                source = untried[0]
+                tried.add(source["url"])
+                if offset and not source["supports_range"]:
+                    f.seek(0)
+                    f.truncate()
+                    offset = 0
+                try:
+                    offset, total_size = self._transfer(
+                        source["url"], f, offset, total_size
+                    )
+                    break
+                except (StallError, requests.RequestException) as e:
+                    offset = f.tell()
+                    logging.warning(
+                        f"Source {source['url']} stalled at {offset} bytes: {e}"
+                    )
+                    # The stalled host's history just dropped; re-rank first.
+                    sources.sort(key=self._score, reverse=True)
+            else:
+                raise StallError(f"All sources stalled after {offset} bytes")
+
+        if total_size is not None and offset != total_size:
+            raise StallError(f"Downloaded {offset} of {total_size} bytes")
+        return offset
+
+    def _transfer(self, url, f, offset, expected_size=None):
+        host = urlparse(url).netloc
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        with requests.get(
+            url, headers=headers, stream=True, timeout=self.stall_timeout
+        ) as response:
+            response.raise_for_status()
+            total_size = _parse_total_size(response)
+            resumable = response.status_code == 206 and (
+                expected_size is None or total_size == expected_size
+            )
+            if offset and not resumable:
+                # Server ignored the range or serves a different file size.
+                if response.status_code == 206:
+                    raise StallError(
+                        f"{url} serves {total_size} bytes, not {expected_size}"
+                    )
+                f.seek(0)
+                f.truncate()
+                offset = 0
+
+            started = window_start = time.monotonic()
+            start_offset = window_offset = offset
+            try:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    offset += len(chunk)
+                    now = time.monotonic()
+                    if now - window_start >= self.stall_window:
+                        rate = (offset - window_offset) / (now - window_start)
+                        if rate < self.min_throughput:
+                            raise StallError(f"throughput fell to {rate:.0f} B/s")
+                        window_start, window_offset = now, offset
+            finally:
+                elapsed = max(time.monotonic() - started, 1e-6)
+                self.history.record(host, (offset - start_offset) / elapsed)
+        return offset, total_size
+
+    @staticmethod
+    def _md5(path):
+        md5_hash = hashlib.md5()
+        with open(path, "rb") as f:
+            for byte_block in iter(lambda: f.read(1024 * 1024), b""):
+                md5_hash.update(byte_block)
+        return md5_hash.hexdigest()
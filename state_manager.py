@@ -1,5 +1,26 @@
 import logging
 
+# Modes a device can be booted into
+MODE_SYSTEM = "system"
+MODE_RECOVERY = "recovery"
+MODE_BOOTLOADER = "bootloader"
+MODE_SIDELOAD = "sideload"
+MODE_EDL = "edl"
+DEVICE_MODES = (MODE_SYSTEM, MODE_RECOVERY, MODE_BOOTLOADER, MODE_SIDELOAD, MODE_EDL)
+
+# adb connection states mapped onto the mode the device is booted into.
+# An unauthorized device is booted normally, adb just may not talk to it yet;
+# rescue is a mode of recovery.
+ADB_STATE_MODES = {
+    "device": MODE_SYSTEM,
+    "unauthorized": MODE_SYSTEM,
+    "authorizing": MODE_SYSTEM,
+    "recovery": MODE_RECOVERY,
+    "rescue": MODE_RECOVERY,
+    "sideload": MODE_SIDELOAD,
+    "bootloader": MODE_BOOTLOADER,
+}
+
 
 class StateManager:
     """
@@ -9,6 +30,7 @@ class StateManager:
     """
 
     _current_state = None
+    _device_modes = {}
 
     @staticmethod
     def set_state(state):
@@ -30,3 +52,15 @@ class StateManager:
             )
         else:
             logging.info(f"State validated: {expected_state}")
+
+    @staticmethod
+    def set_device_mode(mode, serial=None):
+        if mode is not None and mode not in DEVICE_MODES:
+            raise ValueError(f"Unknown device mode: {mode}")
+        if StateManager._device_modes.get(serial) != mode:
+            logging.info(f"Device {serial or 'default'} mode changed to: {mode}")
+        StateManager._device_modes[serial] = mode
+
+    @staticmethod
+    def get_device_mode(serial=None):
+        return StateManager._device_modes.get(serial)
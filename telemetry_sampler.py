@@ -0,0 +1,238 @@
+import logging
+import math
+import threading
+import time
+from array import array
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from device_manager import DeviceManager
+from device_registry import EVENT_REMOVED
+
+# Battery and thermal state in one shell round trip per device
+SAMPLE_COMMAND = (
+    "dumpsys battery; dumpsys thermalservice 2>/dev/null | grep 'Thermal Status'"
+)
+
+METRICS = ("timestamp", "level", "temperature", "charging", "thermal_status")
+
+
+def parse_battery_sample(output):
+    """
+    Extracts numeric battery and thermal readings from SAMPLE_COMMAND output.
+
+    :param output: Text of 'dumpsys battery' plus the thermal status line.
+    :return: Dictionary with level (%), temperature (deg C), charging (0/1)
+        and thermal_status; missing values are NaN.
+    """
+    fields = {}
+    for line in output.splitlines():
+        key, sep, value = line.partition(":")
+        if sep:
+            fields[key.strip()] = value.strip()
+
+    def number(key):
+        try:
+            return float(fields[key])
+        except (KeyError, ValueError):
+            return math.nan
+
+    level = number("level")
+    scale = number("scale")
+    if scale and not math.isnan(scale):
+        level = level * 100.0 / scale
+    charging = any(
+        fields.get(f"{source} powered") == "true" for source in ("AC", "USB", "Wireless")
+    )
+    return {
+        "level": level,
+        "temperature": number("temperature") / 10.0,
+        "charging": 1.0 if charging else 0.0,
+        "thermal_status": number("Thermal Status"),
+    }
+
+
+class RingBuffer:
+    """
+    Fixed-size numeric time series backed by a preallocated array.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._data = array("d", [math.nan]) * capacity
+        self._index = 0
+        self._count = 0
+
+    def append(self, value):
+        self._data[self._index] = value
+        self._index = (self._index + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def latest(self):
+        if not self._count:
+            return math.nan
+        return self._data[self._index - 1]
+
+    def values(self):
+        """Returns the stored samples, oldest first."""
+        if self._count < self.capacity:
+            return self._data[: self._count]
+        return self._data[self._index :] + self._data[: self._index]
+
+    def __len__(self):
+        return self._count
+
+
+class TelemetrySampler:
+    """
+    Periodically samples battery level, temperature, charging state and
+    thermal status for every attached device.
+    All devices are sampled concurrently over their persistent adb shells,
+    and readings are kept in per-device ring buffers.
+    """
+
+    interval = 10.0
+    capacity = 360
+    sample_timeout = 15.0
+
+    # Flash safety thresholds
+    min_battery_level = 30.0
+    max_temperature = 45.0
+    max_thermal_status = 1  # THROTTLING_LIGHT
+    max_sample_age = 60.0
+
+    # Keep a disconnected device's history this long, so reboots and cable
+    # reconnects continue the same series.
+    removed_grace = 600.0
+
+    def __init__(self, registry=None, shell_pool=None):
+        self.registry = registry
+        self.shell_pool = shell_pool or DeviceManager.shell_pool
+        self._series = {}
+        self._removed = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        if registry is not None:
+            registry.subscribe(self._on_device_event)
+
+    # --------------- Lifecycle ---------------
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        logging.info("Telemetry sampler started.")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.sample_timeout)
+            self._thread = None
+        logging.info("Telemetry sampler stopped.")
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            started = time.monotonic()
+            self.sample()
+            self._stop_event.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    # --------------- Sampling ---------------
+    def _targets(self):
+        if self.registry is None:
+            return [None]
+        return [
+            device["serial"]
+            for device in self.registry.devices()
+            if device["state"] == "device"
+        ]
+
+    def sample(self):
+        """
+        Takes one sample from every target device.
+
+        :return: Number of devices sampled successfully.
+        """
+        futures = {}
+        for serial in self._targets():
+            try:
+                futures[serial] = self.shell_pool.session(serial).submit(SAMPLE_COMMAND)
+            except OSError as e:
+                logging.warning(f"Telemetry sample failed for {serial}: {e}")
+
+        self._expire_removed()
+        deadline = time.monotonic() + self.sample_timeout
+        sampled = 0
+        for serial, future in futures.items():
+            try:
+                result = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except (FutureTimeoutError, OSError) as e:
+                logging.warning(f"Telemetry sample failed for {serial}: {e}")
+                continue
+            self.record(serial, parse_battery_sample(result.stdout))
+            sampled += 1
+        return sampled
+
+    def record(self, serial, reading, timestamp=None):
+        with self._lock:
+            series = self._series.get(serial)
+            if series is None:
+                series = {metric: RingBuffer(self.capacity) for metric in METRICS}
+                self._series[serial] = series
+            series["timestamp"].append(timestamp or time.time())
+            for metric in METRICS[1:]:
+                series[metric].append(reading[metric])
+
+    def _on_device_event(self, event, record):
+        with self._lock:
+            if event == EVENT_REMOVED:
+                self._removed[record["serial"]] = time.monotonic()
+            else:
+                self._removed.pop(record["serial"], None)
+
+    def _expire_removed(self):
+        cutoff = time.monotonic() - self.removed_grace
+        with self._lock:
+            for serial, removed_at in list(self._removed.items()):
+                if removed_at <= cutoff:
+                    del self._removed[serial]
+                    self._series.pop(serial, None)
+
+    # --------------- Queries ---------------
+    def latest(self, serial):
+        """Returns the most recent reading for a device, or None."""
+        with self._lock:
+            series = self._series.get(serial)
+            if series is None or not len(series["timestamp"]):
+                return None
+            return {metric: buffer.latest() for metric, buffer in series.items()}
+
+    def history(self, serial, metric):
+        """Returns the stored values of one metric for a device, oldest first."""
+        with self._lock:
+            series = self._series.get(serial)
+            return series[metric].values() if series else array("d")
+
+    def is_safe_to_flash(self, reading, now=None):
+        if reading is None:
+            return False
+        now = now or time.time()
+        thermal_status = reading["thermal_status"]
+        return (
+            now - reading["timestamp"] <= self.max_sample_age
+            and reading["level"] >= self.min_battery_level
+            and reading["temperature"] <= self.max_temperature
+            and (math.isnan(thermal_status) or thermal_status <= self.max_thermal_status)
+        )
+
+    def safe_devices(self):
+        """
+        Lists attached devices whose latest sample is recent, charged enough
+        and not running hot or throttled.
+        """
+        now = time.time()
+        with self._lock:
+            serials = [serial for serial in self._series if serial not in self._removed]
+        return [
+            serial
+            for serial in serials
+            if self.is_safe_to_flash(self.latest(serial), now)
+        ]
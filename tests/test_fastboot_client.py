@@ -0,0 +1,161 @@
+import hashlib
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+import unittest
+
+from fastboot_client import FastbootClient, FastbootError, parse_address
+
+
+class StandInFastboot:
+    """
+    Minimal fastboot TCP device: answers the handshake, getvar, download,
+    flash and reboot, and records what was flashed.
+    """
+
+    def __init__(self, variables=None, flash_delay=0.0):
+        self.variables = {"max-download-size": "0x10000000"}
+        self.variables.update(variables or {})
+        self.flash_delay = flash_delay
+        self.commands = []
+        self.flashed = {}
+        self._server = socket.create_server(("127.0.0.1", 0))
+        self.address = f"tcp:127.0.0.1:{self._server.getsockname()[1]}"
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._server.close()
+        self._thread.join(timeout=5)
+
+    @staticmethod
+    def _recv_exact(connection, size):
+        data = b""
+        while len(data) < size:
+            chunk = connection.recv(size - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return data
+
+    def _serve(self):
+        try:
+            connection, _ = self._server.accept()
+        except OSError:
+            return
+        with connection:
+            try:
+                self._session(connection)
+            except (EOFError, OSError):
+                pass
+
+    def _session(self, connection):
+        def send(data):
+            connection.sendall(struct.pack(">Q", len(data)) + data)
+
+        def recv():
+            (length,) = struct.unpack(">Q", self._recv_exact(connection, 8))
+            return self._recv_exact(connection, length)
+
+        if self._recv_exact(connection, 4) != b"FB01":
+            return
+        connection.sendall(b"FB01")
+        downloaded = b""
+        while True:
+            command = recv().decode()
+            self.commands.append(command)
+            if command == "getvar:all":
+                for name, value in self.variables.items():
+                    send(f"INFO{name}: {value}".encode())
+                send(b"OKAY")
+            elif command.startswith("getvar:"):
+                send(b"OKAY" + self.variables.get(command[7:], "").encode())
+            elif command.startswith("download:"):
+                size = int(command[9:], 16)
+                send(b"DATA%08x" % size)
+                downloaded = b""
+                while len(downloaded) < size:
+                    downloaded += recv()
+                send(b"OKAY")
+            elif command.startswith("flash:"):
+                time.sleep(self.flash_delay)
+                self.flashed[command[6:]] = hashlib.sha256(downloaded).hexdigest()
+                send(b"OKAY")
+            elif command == "reboot":
+                send(b"OKAY")
+                return
+            else:
+                send(b"FAILunknown command")
+
+
+class FastbootClientTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_image(self, name, size):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "wb") as f:
+            f.write(os.urandom(size))
+        with open(path, "rb") as f:
+            return path, hashlib.sha256(f.read()).hexdigest()
+
+    def start_device(self, **kwargs):
+        device = StandInFastboot(**kwargs)
+        self.addCleanup(device.close)
+        return device
+
+    def test_parse_address(self):
+        self.assertEqual(parse_address("tcp:10.0.0.2:5555"), ("10.0.0.2", 5555))
+        self.assertEqual(parse_address("10.0.0.2"), ("10.0.0.2", 5554))
+
+    def test_flashes_several_images_over_one_connection(self):
+        device = self.start_device()
+        boot, boot_hash = self.write_image("boot.img", 9 * 1024 * 1024)
+        dtbo, dtbo_hash = self.write_image("dtbo.img", 5)
+        empty, empty_hash = self.write_image("misc.img", 0)
+        with FastbootClient(device.address) as client:
+            client.flash_all({"boot": boot, "dtbo": dtbo, "misc": empty})
+            client.reboot()
+        self.assertEqual(
+            device.flashed, {"boot": boot_hash, "dtbo": dtbo_hash, "misc": empty_hash}
+        )
+
+    def test_getvar_results_are_cached(self):
+        device = self.start_device(variables={"product": "guacamole"})
+        with FastbootClient(device.address) as client:
+            self.assertEqual(client.getvar_all()["product"], "guacamole")
+            self.assertEqual(client.getvar("product"), "guacamole")
+            self.assertEqual(client.max_download_size(), 0x10000000)
+        self.assertEqual(device.commands, ["getvar:all"])
+
+    def test_fail_response_raises(self):
+        device = self.start_device()
+        with FastbootClient(device.address) as client:
+            with self.assertRaises(FastbootError):
+                client._command("oem unlock-critical")
+
+    def test_slow_flash_outlasts_connect_timeout(self):
+        device = self.start_device(flash_delay=1.5)
+        image, image_hash = self.write_image("boot.img", 1024)
+        with FastbootClient(device.address, timeout=0.5) as client:
+            client.flash("boot", image)
+        self.assertEqual(device.flashed, {"boot": image_hash})
+
+    def test_unusable_max_download_size_raises_fastboot_error(self):
+        image, _ = self.write_image("boot.img", 16)
+        for value in ("", "lots"):
+            with self.subTest(value=value):
+                device = self.start_device(variables={"max-download-size": value})
+                with FastbootClient(device.address) as client:
+                    with self.assertRaises(FastbootError):
+                        client.download(image)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+import bz2
+import hashlib
+import lzma
+import os
+import struct
+import tempfile
+import unittest
+import zipfile
+
+from payload_extractor import (
+    OP_REPLACE,
+    OP_REPLACE_BZ,
+    OP_REPLACE_XZ,
+    OP_ZERO,
+    PayloadError,
+    PayloadExtractor,
+)
+
+BLOCK_SIZE = 4096
+
+
+def varint(value):
+    out = b""
+    while True:
+        byte, value = value & 0x7F, value >> 7
+        if not value:
+            return out + bytes([byte])
+        out += bytes([byte | 0x80])
+
+
+def varint_field(number, value):
+    return varint(number << 3) + varint(value)
+
+
+def bytes_field(number, value):
+    return varint(number << 3 | 2) + varint(len(value)) + value
+
+
+def build_payload(images):
+    """
+    Builds a version 2 payload.bin covering every operation type the extractor
+    supports: REPLACE, REPLACE_XZ, ZERO and REPLACE_BZ, in that order.
+    """
+    data, partitions = b"", []
+    for name, image in images.items():
+        blocks = len(image) // BLOCK_SIZE
+        operations = []
+        for start, count, op_type in (
+            (0, 2, OP_REPLACE),
+            (2, 1, OP_REPLACE_XZ),
+            (3, 2, OP_ZERO),
+            (5, blocks - 5, OP_REPLACE_BZ),
+        ):
+            extent = bytes_field(6, varint_field(1, start) + varint_field(2, count))
+            if op_type == OP_ZERO:
+                operations.append(varint_field(1, op_type) + extent)
+                continue
+            blob = image[start * BLOCK_SIZE : (start + count) * BLOCK_SIZE]
+            if op_type == OP_REPLACE_XZ:
+                blob = lzma.compress(blob)
+            elif op_type == OP_REPLACE_BZ:
+                blob = bz2.compress(blob)
+            operations.append(
+                varint_field(1, op_type)
+                + varint_field(2, len(data))
+                + varint_field(3, len(blob))
+                + extent
+                + bytes_field(8, hashlib.sha256(blob).digest())
+            )
+            data += blob
+        info = varint_field(1, len(image)) + bytes_field(
+            2, hashlib.sha256(image).digest()
+        )
+        partitions.append(
+            bytes_field(1, name.encode())
+            + bytes_field(7, info)
+            + b"".join(bytes_field(8, op) for op in operations)
+        )
+    manifest = varint_field(3, BLOCK_SIZE) + b"".join(
+        bytes_field(13, partition) for partition in partitions
+    )
+    signature = b"signature"
+    header = b"CrAU" + struct.pack(">QQI", 2, len(manifest), len(signature))
+    return header + manifest + signature + data
+
+
+def make_image(blocks):
+    image = bytearray(os.urandom(blocks * BLOCK_SIZE))
+    image[3 * BLOCK_SIZE : 5 * BLOCK_SIZE] = bytes(2 * BLOCK_SIZE)
+    return bytes(image)
+
+
+class PayloadExtractorTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.images = {"boot": make_image(10), "vendor": make_image(7)}
+        self.payload = build_payload(self.images)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def write_ota(self, payload):
+        ota_path = self.path("ota.zip")
+        with zipfile.ZipFile(ota_path, "w") as archive:
+            archive.writestr("META-INF/com/android/metadata", "pre-device=guacamole\n")
+            archive.writestr("payload.bin", payload, compress_type=zipfile.ZIP_STORED)
+        return ota_path
+
+    def test_extracts_and_verifies_all_partitions(self):
+        extractor = PayloadExtractor(self.write_ota(self.payload), max_workers=2)
+        self.assertEqual(extractor.partitions, ["boot", "vendor"])
+        images = extractor.extract(self.path("out"))
+        for name, image in self.images.items():
+            with open(images[name], "rb") as f:
+                self.assertEqual(f.read(), image)
+
+    def test_extracts_selected_partition_from_bare_payload(self):
+        payload_path = self.path("payload.bin")
+        with open(payload_path, "wb") as f:
+            f.write(self.payload)
+        images = PayloadExtractor(payload_path).extract(
+            self.path("out"), partitions=["vendor"]
+        )
+        self.assertEqual(list(images), ["vendor"])
+
+    def test_unknown_partition_is_rejected(self):
+        extractor = PayloadExtractor(self.write_ota(self.payload))
+        with self.assertRaises(PayloadError):
+            extractor.extract(self.path("out"), partitions=["system"])
+
+    def test_truncated_payload_raises_payload_error(self):
+        (manifest_size,) = struct.unpack_from(">Q", self.payload, 12)
+        payload_path = self.path("payload.bin")
+        for cut in range(24, 24 + manifest_size + 64, 7):
+            with self.subTest(cut=cut):
+                with open(payload_path, "wb") as f:
+                    f.write(self.payload[:cut])
+                with self.assertRaises(PayloadError):
+                    PayloadExtractor(payload_path)
+
+    def test_corrupt_operation_data_fails_hash_check(self):
+        corrupted = bytearray(self.payload)
+        corrupted[-1] ^= 0xFF
+        extractor = PayloadExtractor(self.write_ota(bytes(corrupted)))
+        with self.assertRaises(PayloadError):
+            extractor.extract(self.path("out"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from source_selector import (
+    SourceSelector,
+    StallError,
+    ThroughputHistory,
+    candidate_urls,
+)
+
+DATA = os.urandom(1024 * 1024)
+PIECE = 16 * 1024
+
+
+class ThrottledServer:
+    """
+    Local HTTP stand-in for a mirror: serves DATA (with Range support) at
+    a fixed rate, and optionally hangs once it reaches a byte offset.
+    """
+
+    def __init__(self, rate, stall_at=None):
+        self.rate = rate
+        self.stall_at = stall_at
+        self.requests = 0
+        self.release = threading.Event()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}/rom.zip"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.release.set()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        mirror = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                mirror.requests += 1
+                start, end = 0, len(DATA) - 1
+                byte_range = self.headers.get("Range")
+                if byte_range:
+                    first, _, last = byte_range[len("bytes=") :].partition("-")
+                    start, end = int(first), int(last) if last else end
+                    self.send_response(206)
+                    self.send_header(
+                        "Content-Range", f"bytes {start}-{end}/{len(DATA)}"
+                    )
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Length", str(end - start + 1))
+                self.end_headers()
+                position = start
+                try:
+                    while position <= end:
+                        if mirror.stall_at is not None and position >= mirror.stall_at:
+                            mirror.release.wait()
+                            return
+                        size = min(PIECE, end - position + 1)
+                        self.wfile.write(DATA[position : position + size])
+                        position += size
+                        time.sleep(size / mirror.rate)
+                except OSError:
+                    pass
+
+        return Handler
+
+
+class SourceSelectorTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.destination = os.path.join(self.tmp.name, "rom.zip")
+        self.selector = SourceSelector(history=ThroughputHistory())
+        self.selector.stall_timeout = 1.0
+        self.selector.stall_window = 0.5
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def mirror(self, rate, stall_at=None):
+        server = ThrottledServer(rate, stall_at)
+        self.addCleanup(server.close)
+        return server
+
+    def test_candidate_urls(self):
+        entry = {
+            "url": "https://a.example/rom.zip",
+            "repo_url": "LineageOS/android_device_oneplus_guacamole",
+            "mirrors": ["https://b.example/rom.zip", "https://a.example/rom.zip"],
+        }
+        self.assertEqual(
+            candidate_urls(entry),
+            ["https://a.example/rom.zip", "https://b.example/rom.zip"],
+        )
+
+    def test_downloads_from_fastest_source(self):
+        fast, slow = self.mirror(20_000_000), self.mirror(500_000)
+        self.selector.download(
+            [slow.url, fast.url], self.destination, hashlib.md5(DATA).hexdigest()
+        )
+        with open(self.destination, "rb") as f:
+            self.assertEqual(f.read(), DATA)
+        # One probe each, then the whole transfer from the fast mirror.
+        self.assertEqual((fast.requests, slow.requests), (2, 1))
+
+    def test_tries_every_source_before_retrying_a_stalled_one(self):
+        stalls = [self.mirror(20_000_000, stall_at=512 * 1024) for _ in range(2)]
+        healthy = self.mirror(1_000_000)
+        urls = [server.url for server in stalls] + [healthy.url]
+        self.selector.download(urls, self.destination, hashlib.md5(DATA).hexdigest())
+        with open(self.destination, "rb") as f:
+            self.assertEqual(f.read(), DATA)
+        self.assertEqual(healthy.requests, 2)
+
+    def test_all_sources_stalling_removes_partial_file(self):
+        stalls = [self.mirror(20_000_000, stall_at=512 * 1024) for _ in range(2)]
+        with self.assertRaises(StallError):
+            self.selector.download([server.url for server in stalls], self.destination)
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+    def test_slow_trickle_is_detected_within_the_window(self):
+        trickle = self.mirror(8_000)
+        self.selector.stall_timeout = 30.0
+        started = time.monotonic()
+        with open(self.destination, "wb") as f:
+            with self.assertRaises(StallError):
+                self.selector._transfer(trickle.url, f, 0)
+        self.assertLess(time.monotonic() - started, 10)
+
+
+if __name__ == "__main__":
+    unittest.main()